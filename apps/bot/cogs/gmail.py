@@ -1,11 +1,19 @@
 import logging
+import math
+from datetime import timedelta
 
 from aiogoogle import AuthError
 from discord.ext import commands, tasks
 
-from notilib import InvalidRefreshTokenError
+from notilib import InvalidRefreshTokenError, config
 from notilib.email_clients import gmail
-from helper import Client, build_gmail_received_embed
+from helper import (
+    Client,
+    MailboxSyncDispatcher,
+    TokenRefresher,
+    build_gmail_received_embed,
+    fan_out_direct_messages
+)
 
 
 logger = logging.getLogger(__name__)
@@ -14,12 +22,22 @@ logger = logging.getLogger(__name__)
 class Gmail(commands.Cog):
     def __init__(self, client: Client):
         self.client = client
+        self.token_refresher = TokenRefresher()
+        self.sync_dispatcher = MailboxSyncDispatcher(self.sync_mailbox)
 
 
     @commands.Cog.listener()
-    async def on_gmail_email_receive(self, email_address: str) -> None:
+    async def on_gmail_email_receive(
+        self,
+        email_address: str,
+        history_id: int=None
+    ) -> None:
+        await self.sync_dispatcher.submit(email_address, history_id)
+
+
+    async def sync_mailbox(self, email_address: str, history_id: int=None) -> None:
         try:
-            email = await gmail.retrieve_new_email(email_address)
+            emails = await gmail.sync_new_emails(email_address, history_id)
         except (InvalidRefreshTokenError, AuthError) as exc:
             if isinstance(exc, AuthError):
                 await gmail.set_credentials_validity(email_address, valid=False)
@@ -27,41 +45,70 @@ class Gmail(commands.Cog):
             logging.debug('Failed to refresh user credentials')
             return  # user credentials couldn't be refreshed
 
-        # false alarm (latest email has already been notified)
-        if email is None:
+        # false alarm (every email has already been notified)
+        if not emails:
             logger.debug('No new email to send!')
             return
 
-        embed = build_gmail_received_embed(email_address, email)
-
         # send notification to all users that have the email address connected
-        user_ids = await gmail.email_address_to_discord_ids(email_address)
+        # (the routing table is only missing if it failed to load on startup)
+        subscribers = self.client.mailbox_routing.get_subscribers(email_address, 'gmail')
+        if subscribers is None:
+            subscribers = await gmail.get_subscriber_filters(email_address)
 
-        for user_id in user_ids:
-            # dont notify the user if the email properties go against the
-            # user's filter settings
-            if await gmail.check_filters(user_id, email_address, email) is False:
-                continue
+        for email in emails:
+            embed = build_gmail_received_embed(email_address, email)
 
-            user = self.client.get_user(user_id)
+            # dont notify users if the email properties go against their
+            # filter settings
+            recipient_ids = [
+                subscriber.discord_id for subscriber in subscribers
+                if subscriber.allows_sender(email.sender)
+            ]
 
-            if user is None:
-                logger.debug(f'Unable to fetch user with ID: {user_id}')
-                continue
+            logger.info(f'Sending email notification to {len(recipient_ids)} users')
+            await fan_out_direct_messages(self.client, recipient_ids, embed=embed)
 
-            logger.info(f'Sending email notification to user with ID: {user_id}')
-            await user.send(embed=embed)
 
-
-    # rewatch all user inboxes every 24 hours
-    @tasks.loop(hours=24)
+    # renew inbox watches before they expire, spread evenly across the day
+    @tasks.loop(minutes=config('global.gmail.rewatch.interval_minutes'))
     async def rewatch_inboxes(self) -> None:
-        user_creds_list = await gmail.load_all_user_credentials()
-        await gmail.batch_watch_requests(user_creds_list)
+        inbox_count = await gmail.count_watched_inboxes()
+
+        # a days worth of rewatches divided over the runs in a day, the window
+        # leaves plenty of headroom since watches only expire every 7 days
+        limit = math.ceil(inbox_count * self.rewatch_inboxes.minutes / (24 * 60))
+        if limit == 0:
+            return
+
+        rewatched = await gmail.rewatch_due_inboxes(
+            window=timedelta(hours=config('global.gmail.rewatch.window_hours')),
+            limit=limit
+        )
+        logger.info(f'Rewatched {rewatched} inboxes')
+
+
+    # remove seen email ids that are no longer needed for duplicate checks
+    @tasks.loop(hours=6)
+    async def prune_previous_email_ids(self) -> None:
+        await gmail.prune_previous_email_ids()
 
 
     async def cog_load(self):
         self.rewatch_inboxes.start()
+        self.prune_previous_email_ids.start()
+
+        # refresh access tokens before they expire
+        self.token_refresher.start()
+        self.client.event_server.metrics['token_refresher'] = \
+            self.token_refresher.metrics.as_dict
+
+
+    async def cog_unload(self):
+        self.rewatch_inboxes.cancel()
+        self.prune_previous_email_ids.cancel()
+        self.token_refresher.stop()
+        self.client.event_server.metrics.pop('token_refresher', None)
 
 
 async def setup(client: Client) -> None:
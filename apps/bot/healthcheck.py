@@ -1,14 +1,30 @@
+import asyncio
 import json
-import socket
 
-from notilib import config
+from notilib import config, encode_frame, read_frame
 
 
-json_data = json.dumps({'action': 'healthcheck'})
+async def healthcheck() -> dict | None:
+    reader, writer = await asyncio.open_connection('bot', config('apps.bot.socket_port'))
+
+    try:
+        writer.write(encode_frame({'action': 'healthcheck'}))
+        await writer.drain()
+
+        response = await read_frame(reader)
+    finally:
+        writer.close()
+
+    return response
+
 
 try:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-        client.connect(('bot', config('apps.bot.socket_port')))
-        client.send(json_data.encode())
-except ConnectionError:
+    response = asyncio.run(asyncio.wait_for(healthcheck(), timeout=4))
+except (ConnectionError, OSError, asyncio.TimeoutError):
+    response = None
+
+if response is None or response.get('status') != 'ok':
     exit(1)
+
+# kept as the output of the last healthcheck (for example by `docker inspect`)
+print(json.dumps(response.get('metrics', {})))
@@ -1,4 +1,9 @@
 from .client import *
+from .direct_messages import *
+from .event_queue_consumer import *
+from .event_server import *
+from .mailbox_routing import *
 
 from .gmail.embeds import *
-from .socket_listener import *
+from .gmail.sync_dispatcher import *
+from .gmail.token_refresher import *
@@ -1,10 +1,13 @@
 import logging
-from threading import Thread
 
 import discord
 from discord.ext import commands
 
-from .socket_listener import start_socket_listener
+from notilib import listen_for_cache_invalidations
+from notilib.email_clients.gmail import GoogleHttpClient, preload_gmail_api
+from .event_queue_consumer import EventQueueConsumer
+from .event_server import EventServer
+from .mailbox_routing import MailboxRoutingTable
 
 
 logger = logging.getLogger(__name__)
@@ -23,11 +26,23 @@ class Client(commands.Bot):
         )
 
         self.cog_list = cogs
+        self.event_queue_consumer = EventQueueConsumer(self)
+        self.event_server = EventServer(self.event_queue_consumer)
+        self.mailbox_routing = MailboxRoutingTable()
 
 
     async def setup_hook(self):
-        # launch gmail email received socket listener in different thread
-        Thread(target=start_socket_listener, args=(self,)).start()
+        # drop cached data that the website changes
+        await listen_for_cache_invalidations()
+
+        # open the shared connection pool used for google api requests
+        await GoogleHttpClient().start()
+
+        # load the gmail discovery document before the first notification needs it
+        try:
+            await preload_gmail_api()
+        except Exception:
+            logger.warning('Failed to preload gmail discovery document', exc_info=True)
 
         # load passed cogs
         if self.cog_list is not None:
@@ -38,9 +53,25 @@ class Client(commands.Bot):
                 except (commands.errors.ExtensionNotFound, commands.errors.ExtensionFailed):
                     logger.error(f'Failed to load cog: {cog}')
 
+        # load who to notify about each email address before handling events
+        await self.mailbox_routing.start()
+
+        # handle queued events once the cogs listening for them are loaded
+        await self.event_queue_consumer.start()
+
+        # listen for the events (such as gmail email received) forwarded by the website
+        await self.event_server.start()
+
         # sync slash command tree
         await self.tree.sync()
 
+    async def close(self):
+        self.event_queue_consumer.stop()
+        self.mailbox_routing.stop()
+        await self.event_server.close()
+        await GoogleHttpClient().close()
+        await super().close()
+
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})\n------')
 
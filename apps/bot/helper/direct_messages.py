@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import random
+import time
+from typing import NamedTuple
+
+import discord
+
+from notilib import config, gather_with_concurrency
+
+
+logger = logging.getLogger(__name__)
+
+
+class DirectMessageResult(NamedTuple):
+    """The outcome of sending a direct message to a user"""
+    user_id: int
+    sent: bool
+    attempts: int
+    latency: float  # seconds
+    error: str | None = None
+
+
+def _should_retry(exc: discord.HTTPException) -> bool:
+    # rate limited or a discord server error
+    return exc.status == 429 or exc.status >= 500
+
+
+async def send_direct_message(
+    client: discord.Client,
+    user_id: int,
+    **kwargs
+) -> DirectMessageResult:
+    """
+    Sends a direct message to a user, retrying with backoff if discord is\
+        rate limiting or having issues.
+    discord.py already waits out rate limit buckets and retries internally,\
+        this only retries what makes it through that.
+    :param client: the bot client to send the message with
+    :param user_id: the id of the user to send the message to
+    :param kwargs: the arguments to send the message with, for example `embed`
+    """
+    max_retries = config('apps.bot.direct_messages.max_retries')
+    retry_delay = config('apps.bot.direct_messages.retry_delay_seconds')
+
+    started_at = time.perf_counter()
+
+    user = client.get_user(user_id)
+    if user is None:
+        logger.debug(f'Unable to fetch user with ID: {user_id}')
+        return DirectMessageResult(user_id, False, 0, 0.0, 'User not found')
+
+    attempt = 0
+    while True:
+        attempt += 1
+
+        try:
+            await user.send(**kwargs)
+        except discord.HTTPException as exc:
+            if not _should_retry(exc) or attempt > max_retries:
+                latency = time.perf_counter() - started_at
+                logger.warning(
+                    f'Failed to message user with ID: {user_id} '
+                    f'(status {exc.status}, attempts {attempt}, {latency:.3f}s)'
+                )
+                return DirectMessageResult(user_id, False, attempt, latency, exc.text)
+
+            await asyncio.sleep(retry_delay * 2 ** (attempt - 1) * (1 + random.random()))
+            continue
+        except Exception as exc:
+            # for example a connection error, which shouldn't stop the other
+            # users of a fan out from being messaged
+            latency = time.perf_counter() - started_at
+            logger.exception(
+                f'Failed to message user with ID: {user_id} '
+                f'(attempts {attempt}, {latency:.3f}s)'
+            )
+            return DirectMessageResult(user_id, False, attempt, latency, repr(exc))
+
+        latency = time.perf_counter() - started_at
+        logger.info(
+            f'Sent message to user with ID: {user_id} '
+            f'(attempts {attempt}, {latency:.3f}s)'
+        )
+        return DirectMessageResult(user_id, True, attempt, latency)
+
+
+async def fan_out_direct_messages(
+    client: discord.Client,
+    user_ids: list[int],
+    **kwargs
+) -> list[DirectMessageResult]:
+    """
+    Sends the same direct message to many users concurrently, with at most\
+        `apps.bot.direct_messages.max_concurrent` being sent at the same time
+    :param client: the bot client to send the messages with
+    :param user_ids: the ids of the users to send the message to
+    :param kwargs: the arguments to send the message with, for example `embed`
+
+    :return: the outcome for each user, in the same order as `user_ids`
+    """
+    return await gather_with_concurrency(
+        config('apps.bot.direct_messages.max_concurrent'),
+        *(send_direct_message(client, user_id, **kwargs) for user_id in user_ids)
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from discord.ext import commands
+
+from notilib import (
+    EVENT_QUEUE_CHANNEL,
+    Database,
+    QueuedEvent,
+    complete_events,
+    config,
+    dequeue_events,
+    fail_event
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def call_event_listeners(
+    client: commands.Bot,
+    event_name: str,
+    args: list=(),
+    kwargs: dict=None
+) -> None:
+    """
+    Calls every listener of an event and waits for them to finish. Unlike\
+        `client.dispatch`, this lets the caller know when (and whether) the\
+        event has been handled.
+    :param client: the bot client whose listeners to call
+    :param event_name: the name of the event, for example `gmail_email_receive`
+    :param args: the positional arguments to call the listeners with
+    :param kwargs: the keyword arguments to call the listeners with
+    :raises Exception: the first error raised by a listener
+    """
+    listeners = client.extra_events.get(f'on_{event_name}', [])
+
+    await asyncio.gather(*(listener(*args, **(kwargs or {})) for listener in listeners))
+
+
+class EventQueueConsumer:
+    def __init__(self, client: commands.Bot) -> None:
+        """
+        Drains the durable event queue (see `notilib.event_queue`) and calls\
+            the listeners of each event. Consumers are woken up through\
+            `LISTEN` as soon as an event is enqueued, and also poll on an\
+            interval to pick up retries and events that timed out.
+        :param client: the bot client to call the event listeners of
+        """
+        self.client = client
+
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+
+
+    @staticmethod
+    def _config(key: str) -> int | float:
+        return config(f'apps.bot.event_queue.{key}')
+
+
+    def _on_notify(self, *_) -> None:
+        self._wakeup.set()
+
+
+    async def _handle(self, event: QueuedEvent) -> bool:
+        try:
+            await call_event_listeners(self.client, event.event_name, kwargs=event.kwargs)
+            return True
+        except Exception as exc:
+            # back off exponentially with each attempt
+            retry_delay = timedelta(seconds=self._config('retry_delay_seconds'))
+            retry_delay *= 2 ** (event.attempts - 1)
+
+            retrying = await fail_event(event, repr(exc), retry_delay)
+            logger.error(
+                f'Failed to handle queued event {event.event_id} '
+                f'(attempt {event.attempts}, retrying: {retrying})', exc_info=True)
+            return False
+
+
+    async def handle_events(self, event_ids: list[int] | None=None) -> int:
+        """
+        Claims a batch of events from the queue and handles them
+        :param event_ids: only handle the events with these ids (for example\
+            the ones forwarded to the event server), events that have already\
+            been claimed are skipped
+
+        :return: the amount of events that were claimed
+        """
+        events = await dequeue_events(
+            limit=len(event_ids) if event_ids is not None else self._config('batch_size'),
+            visibility_timeout=timedelta(
+                seconds=self._config('visibility_timeout_seconds')),
+            event_ids=event_ids
+        )
+        if not events:
+            return 0
+
+        results = await asyncio.gather(*(self._handle(event) for event in events))
+
+        await complete_events(
+            [event.event_id for event, handled in zip(events, results) if handled])
+        return len(events)
+
+
+    async def _work(self) -> None:
+        while True:
+            # cleared before draining so that events enqueued meanwhile aren't missed
+            self._wakeup.clear()
+
+            try:
+                # keep going while there are full batches
+                if await self.handle_events() == self._config('batch_size'):
+                    continue
+            except Exception:
+                logger.error('Failed to drain the event queue', exc_info=True)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self._config('poll_interval_seconds'))
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def start(self) -> None:
+        """Starts draining the event queue in the background"""
+        await Database().add_listener(EVENT_QUEUE_CHANNEL, self._on_notify)
+
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(self._config('workers'))
+        ]
+
+
+    def stop(self) -> None:
+        """Stops draining the event queue"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Callable
+
+from notilib import InvalidFrameError, config, encode_frame, read_frame
+from .event_queue_consumer import EventQueueConsumer
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventServer:
+    def __init__(self, event_queue_consumer: EventQueueConsumer) -> None:
+        """
+        Listens for length-prefixed json messages from the other apps (for\
+            example the website). The website forwards the id of every event\
+            it queues, which is claimed and handled right away instead of\
+            waiting for a queue consumer to finish its current batch.
+        Each connection can carry any amount of messages. Received event ids\
+            wait in a bounded queue, when it is full connections stop being\
+            read from, so senders are slowed down instead of events piling up.
+        :param event_queue_consumer: the consumer to handle forwarded events with
+        """
+        self.event_queue_consumer = event_queue_consumer
+
+        self._queue: asyncio.Queue[int] = asyncio.Queue(
+            maxsize=config('apps.bot.event_server.max_pending_events'))
+
+        self._server: asyncio.Server | None = None
+        self._workers: list[asyncio.Task] = []
+
+        # functions returning metrics to include in healthcheck responses, by name
+        self.metrics: dict[str, Callable[[], dict]] = {}
+
+
+    async def _work(self) -> None:
+        while True:
+            event_id = await self._queue.get()
+
+            try:
+                # events that a queue consumer has already claimed are skipped
+                await self.event_queue_consumer.handle_events([event_id])
+            except Exception:
+                logger.error(f'Failed to handle forwarded event {event_id}', exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+    async def _handle_message(self, message: dict, writer: asyncio.StreamWriter) -> None:
+        # execute certain action based on received data
+        match message.get('action'):
+            case 'dispatch_queued_event' if isinstance(message.get('event_id'), int):
+                # waits while the queue is full (backpressure)
+                await self._queue.put(message['event_id'])
+            case 'healthcheck':
+                metrics = {name: get_metrics() for name, get_metrics in self.metrics.items()}
+                writer.write(encode_frame({'status': 'ok', 'metrics': metrics}))
+                await writer.drain()
+            case action:
+                logger.warning(f'Received message with unknown action: {action}')
+
+
+    async def _handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while (message := await read_frame(reader)) is not None:
+                await self._handle_message(message, writer)
+        except InvalidFrameError:
+            logger.error('Received invalid frame, closing connection', exc_info=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def start(self) -> None:
+        """Starts listening for connections on the configured socket port"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, '0.0.0.0', config('apps.bot.socket_port'))
+
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(config('apps.bot.event_server.max_concurrent_events'))
+        ]
+
+        logger.info(f'Event server listening on port {config("apps.bot.socket_port")}')
+
+
+    async def close(self) -> None:
+        """Stops accepting connections and stops handling events"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
@@ -1 +1,3 @@
 from .embeds import *
+from .sync_dispatcher import *
+from .token_refresher import *
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+def _merge_history_ids(history_id: int | None, other: int | None) -> int | None:
+    # a push without a history id has to sync regardless of what has been synced
+    if history_id is None or other is None:
+        return None
+    return max(int(history_id), int(other))
+
+
+class _MailboxSyncState:
+    def __init__(self) -> None:
+        self.running = False
+
+        # the follow-up sync that pushes received meanwhile are merged into
+        self.follow_up: asyncio.Future | None = None
+        self.history_id: int | None = None
+
+
+class MailboxSyncDispatcher:
+    def __init__(self, sync: Callable[[str, int | None], Awaitable[None]]) -> None:
+        """
+        Makes sure each mailbox has at most one sync running at a time.\
+            Pushes that arrive while a mailbox is syncing are merged into a\
+            single follow-up sync, which runs once the current one finishes.
+        :param sync: the function that syncs a mailbox, called with the email\
+            address and the (highest) history id of the merged pushes
+        """
+        self._sync = sync
+        self._states: dict[str, _MailboxSyncState] = {}
+
+        # keep references to the running syncs so they aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+
+    async def submit(self, email_address: str, history_id: int | None=None) -> None:
+        """
+        Requests a sync of a mailbox and waits for a sync that covers the request
+        :param email_address: the email address of the mailbox to sync
+        :param history_id: the history id sent along with the push
+        """
+        state = self._states.get(email_address)
+
+        if state is None:
+            state = self._states[email_address] = _MailboxSyncState()
+
+        if state.follow_up is None:
+            state.follow_up = asyncio.get_running_loop().create_future()
+            state.history_id = history_id
+        else:
+            logger.debug('Merging push into the pending mailbox sync')
+            state.history_id = _merge_history_ids(state.history_id, history_id)
+
+        follow_up = state.follow_up
+
+        if not state.running:
+            state.running = True
+
+            task = asyncio.create_task(self._run(email_address, state))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        # shielded so that one waiter being cancelled doesn't cancel the others
+        await asyncio.shield(follow_up)
+
+
+    async def _run(self, email_address: str, state: _MailboxSyncState) -> None:
+        try:
+            while state.follow_up is not None:
+                sync, history_id = state.follow_up, state.history_id
+                state.follow_up, state.history_id = None, None
+
+                try:
+                    await self._sync(email_address, history_id)
+                except Exception as exc:
+                    sync.set_exception(exc)
+                else:
+                    sync.set_result(None)
+        finally:
+            state.running = False
+            del self._states[email_address]
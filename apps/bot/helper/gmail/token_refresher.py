@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import logging
+import random
+from datetime import datetime, timedelta
+
+from aiogoogle.auth.creds import UserCreds
+
+from notilib import InvalidRefreshTokenError, config, gather_with_concurrency
+from notilib.email_clients.gmail import (
+    credentials_expire_at,
+    load_all_user_credentials,
+    refresh_user_credentials
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefreshMetrics:
+    def __init__(self) -> None:
+        """Counters describing how well the token refresher is keeping up"""
+        self.refreshes = 0
+        self.failures = 0
+        self.invalidated = 0
+        # refreshes that only happened after the access token had expired
+        self.late_refreshes = 0
+
+        # how long after their scheduled time refreshes actually ran (seconds)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+
+    @property
+    def average_lag(self) -> float:
+        if self.refreshes == 0:
+            return 0.0
+        return self.total_lag / self.refreshes
+
+
+    def record_refresh(self, lag: float, late: bool) -> None:
+        self.refreshes += 1
+        self.late_refreshes += late
+
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+
+
+    def as_dict(self) -> dict:
+        return {
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'invalidated': self.invalidated,
+            'late_refreshes': self.late_refreshes,
+            'last_lag': round(self.last_lag, 3),
+            'max_lag': round(self.max_lag, 3),
+            'average_lag': round(self.average_lag, 3)
+        }
+
+
+class TokenRefresher:
+    def __init__(self) -> None:
+        """
+        Refreshes gmail credentials in the background shortly before they\
+            expire, so that notifications don't have to wait on a refresh.
+        Credentials are kept in a min-heap ordered by when they are due to be\
+            refreshed, and are reloaded from the database periodically to pick\
+            up new and removed mailboxes.
+        """
+        self.metrics = TokenRefreshMetrics()
+
+        self._credentials: dict[str, UserCreds] = {}
+
+        # heap of (refresh at, email address), entries that no longer match
+        # `self._refresh_at` are stale and get skipped
+        self._schedule: list[tuple[datetime, str]] = []
+        self._refresh_at: dict[str, datetime] = {}
+
+        self._task: asyncio.Task | None = None
+
+
+    @staticmethod
+    def _config(key: str) -> int | float:
+        return config(f'apps.bot.token_refresher.{key}')
+
+
+    def _schedule_refresh(self, email_address: str, user_creds: UserCreds) -> None:
+        self._credentials[email_address] = user_creds
+
+        lead_time = timedelta(minutes=self._config('lead_time_minutes'))
+        jitter = timedelta(minutes=self._config('jitter_minutes')) * random.random()
+
+        # credentials that are already due (or have no known expiry) are
+        # refreshed right away
+        refresh_at = datetime.utcnow()
+
+        expires_at = credentials_expire_at(user_creds)
+        if expires_at is not None:
+            refresh_at = max(refresh_at, expires_at - lead_time - jitter)
+
+        self._refresh_at[email_address] = refresh_at
+        heapq.heappush(self._schedule, (refresh_at, email_address))
+
+
+    def _schedule_retry(self, email_address: str) -> None:
+        retry_delay = timedelta(minutes=self._config('retry_delay_minutes'))
+        refresh_at = datetime.utcnow() + retry_delay * (1 + random.random())
+
+        self._refresh_at[email_address] = refresh_at
+        heapq.heappush(self._schedule, (refresh_at, email_address))
+
+
+    def _unschedule(self, email_address: str) -> None:
+        self._credentials.pop(email_address, None)
+        self._refresh_at.pop(email_address, None)
+
+
+    def _pop_due(self) -> list[tuple[datetime, str]]:
+        now = datetime.utcnow()
+        due = []
+
+        while self._schedule and self._schedule[0][0] <= now:
+            refresh_at, email_address = heapq.heappop(self._schedule)
+
+            if self._refresh_at.get(email_address) == refresh_at:
+                due.append((refresh_at, email_address))
+
+        return due
+
+
+    async def reload(self) -> None:
+        """Rebuilds the schedule from the credentials stored in the database"""
+        all_creds = [creds async for creds in load_all_user_credentials(refresh=False)]
+
+        self._credentials.clear()
+        self._refresh_at.clear()
+        self._schedule.clear()
+
+        for email_address, user_creds in all_creds:
+            self._schedule_refresh(email_address, user_creds)
+
+        logger.info(
+            f'Scheduled {len(all_creds)} gmail credential refreshes '
+            f'(metrics: {self.metrics.as_dict()})'
+        )
+
+
+    async def _refresh(self, refresh_at: datetime, email_address: str) -> None:
+        user_creds = self._credentials.get(email_address)
+        if user_creds is None:
+            return
+
+        started_at = datetime.utcnow()
+        expires_at = credentials_expire_at(user_creds)
+
+        try:
+            user_creds = await refresh_user_credentials(
+                email_address, user_creds, force=True)
+        except InvalidRefreshTokenError:
+            # the credentials have been marked invalid so stop refreshing them
+            self.metrics.invalidated += 1
+            self._unschedule(email_address)
+            return
+        except Exception:
+            self.metrics.failures += 1
+            logger.warning('Failed to refresh gmail credentials', exc_info=True)
+            self._schedule_retry(email_address)
+            return
+
+        self.metrics.record_refresh(
+            lag=(started_at - refresh_at).total_seconds(),
+            late=expires_at is not None and started_at >= expires_at
+        )
+        self._schedule_refresh(email_address, user_creds)
+
+
+    async def _sleep_until_next_refresh(self, reload_at: datetime) -> None:
+        wake_at = reload_at
+        if self._schedule:
+            wake_at = min(wake_at, self._schedule[0][0])
+
+        delay = (wake_at - datetime.utcnow()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+    async def _run(self) -> None:
+        reload_interval = timedelta(minutes=self._config('reload_interval_minutes'))
+        reload_at = datetime.utcnow()
+
+        while True:
+            if datetime.utcnow() >= reload_at:
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.error('Failed to load gmail credentials', exc_info=True)
+                reload_at = datetime.utcnow() + reload_interval
+
+            due = self._pop_due()
+            if due:
+                await gather_with_concurrency(
+                    self._config('max_concurrent_refreshes'),
+                    *(self._refresh(refresh_at, email_address)
+                      for refresh_at, email_address in due)
+                )
+
+            await self._sleep_until_next_refresh(reload_at)
+
+
+    def start(self) -> None:
+        """Starts refreshing credentials in the background"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+
+    def stop(self) -> None:
+        """Stops refreshing credentials in the background"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+
+from notilib import (
+    SUBSCRIBER_FILTERS_CHANNEL,
+    Database,
+    SubscriberFilters,
+    SubscriberFiltersChange,
+    WebmailServiceLiteral,
+    config,
+    get_subscriber_filters_by_hash,
+    hash_email_address,
+    load_all_subscriber_filters,
+    subscriber_filters_cache
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# (email address hash, webmail service)
+_RouteKey = tuple[bytes, WebmailServiceLiteral]
+
+# (discord id, email address hash, webmail service)
+_SubscriptionKey = tuple[int, bytes, WebmailServiceLiteral]
+
+
+class MailboxRoutingTable:
+    def __init__(self) -> None:
+        """
+        Keeps the users subscribed to each email address, along with their\
+            filter settings, in memory so that routing a notification doesn't\
+            need any database queries.
+        The table is loaded on start and kept up to date through the\
+            notifications sent by the `email_notification_filters` triggers.\
+            Notifications can be missed (for example while the listener\
+            reconnects), so the table is also reloaded on an interval.
+        """
+        self._routes: dict[_RouteKey, dict[int, SubscriberFilters]] = {}
+        self._loaded = False
+
+        # changes are applied one at a time, in the order they were sent
+        self._changes: asyncio.Queue[_SubscriptionKey] = asyncio.Queue()
+
+        # subscriptions that changed while the table was being reloaded
+        self._changed_during_reload: set[_SubscriptionKey] | None = None
+
+        self._tasks: list[asyncio.Task] = []
+
+        # keep references to the reloads after reconnecting so they aren't
+        # garbage collected
+        self._reload_tasks: set[asyncio.Task] = set()
+
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+
+    def get_subscribers(
+        self,
+        email_address: str,
+        webmail_service: WebmailServiceLiteral
+    ) -> list[SubscriberFilters] | None:
+        """
+        Returns the filter settings of every user that has an email address connected
+        :param email_address: the email address to get the subscribers of
+        :param webmail_service: the webmail service of the email address
+
+        :return: the subscribers, or `None` if the table hasn't been loaded yet
+        """
+        if not self._loaded:
+            return None
+
+        subscribers = self._routes.get((hash_email_address(email_address), webmail_service))
+        return list(subscribers.values()) if subscribers else []
+
+
+    def _set(self, key: _SubscriptionKey, filters: SubscriberFilters | None) -> None:
+        discord_id, email_address_hash, webmail_service = key
+        route_key = (email_address_hash, webmail_service)
+
+        if filters is not None:
+            self._routes.setdefault(route_key, {})[discord_id] = filters
+            return
+
+        subscribers = self._routes.get(route_key)
+        if subscribers is not None:
+            subscribers.pop(discord_id, None)
+            if not subscribers:
+                del self._routes[route_key]
+
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        try:
+            change = SubscriberFiltersChange.from_payload(payload)
+        except (ValueError, KeyError):
+            logger.warning(f'Received invalid subscriber filters change: {payload}')
+            return
+
+        self._changes.put_nowait(
+            (change.discord_id, change.email_address_hash, change.webmail_service))
+
+
+    async def _apply_changes(self) -> None:
+        while True:
+            key = await self._changes.get()
+
+            if self._changed_during_reload is not None:
+                self._changed_during_reload.add(key)
+
+            # the current state of the row is fetched rather than trusting the
+            # operation, so applying a change more than once is harmless
+            subscriber_filters_cache.invalidate(key)
+            try:
+                self._set(key, await get_subscriber_filters_by_hash(*key))
+            except Exception:
+                logger.error('Failed to apply subscriber filters change', exc_info=True)
+
+
+    async def reload(self) -> None:
+        """Rebuilds the table from the database"""
+        self._changed_during_reload = set()
+
+        try:
+            routes: dict[_RouteKey, dict[int, SubscriberFilters]] = {}
+            async for email_address_hash, webmail_service, filters \
+                    in load_all_subscriber_filters():
+                routes.setdefault(
+                    (email_address_hash, webmail_service), {})[filters.discord_id] = filters
+
+            self._routes = routes
+            self._loaded = True
+
+            # the reload may have read rows from before these changes
+            for key in self._changed_during_reload:
+                self._changes.put_nowait(key)
+        finally:
+            self._changed_during_reload = None
+
+        logger.info(
+            f'Loaded {sum(map(len, self._routes.values()))} subscriptions '
+            f'for {len(self._routes)} email addresses'
+        )
+
+
+    async def _try_reload(self) -> None:
+        try:
+            await self.reload()
+        except Exception:
+            logger.error('Failed to reload the mailbox routing table', exc_info=True)
+
+
+    def _on_reconnect(self) -> None:
+        # changes sent while the listener was reconnecting are lost
+        task = asyncio.create_task(self._try_reload())
+        self._reload_tasks.add(task)
+        task.add_done_callback(self._reload_tasks.discard)
+
+
+    async def _reconcile(self) -> None:
+        reconcile_interval = config('apps.bot.mailbox_routing.reconcile_interval_minutes')
+
+        while True:
+            await asyncio.sleep(reconcile_interval * 60)
+            await self._try_reload()
+
+
+    async def start(self) -> None:
+        """Loads the table and starts keeping it up to date"""
+        # listen first so that no changes are missed while loading
+        await Database().add_listener(
+            SUBSCRIBER_FILTERS_CHANNEL, self._on_notify, on_reconnect=self._on_reconnect)
+
+        self._tasks = [
+            asyncio.create_task(self._apply_changes()),
+            asyncio.create_task(self._reconcile())
+        ]
+
+        try:
+            await self.reload()
+        except Exception:
+            # subscribers are queried from the database until the next reload
+            logger.error('Failed to load the mailbox routing table', exc_info=True)
+
+
+    def stop(self) -> None:
+        """Stops keeping the table up to date"""
+        for task in [*self._tasks, *self._reload_tasks]:
+            task.cancel()
+        self._tasks = []
@@ -4,7 +4,8 @@ import logging
 from quart import Quart, jsonify
 from dotenv import load_dotenv; load_dotenv()
 
-from notilib import Database, setup_logging, PROJECT_PATH
+from notilib import Database, listen_for_cache_invalidations, setup_logging, PROJECT_PATH
+from notilib.email_clients.gmail import GoogleHttpClient, preload_gmail_api
 
 from blueprints.gmail.gmail import gmail_bp
 from blueprints.discord.discord import discord_bp
@@ -13,6 +14,7 @@ from blueprints.error_handling.error_handling import error_handling_bp
 from blueprints.login.login import login_bp
 from blueprints.redirects.redirects import redirects_bp
 from blueprints.index.index import index_bp
+from helper import event_forwarder
 
 
 # -------------------------- LOGGING -------------------------- #
@@ -55,12 +57,44 @@ async def create_db_pool():
     await db._create_pool()
 
 
+@app.before_serving
+async def start_cache_invalidation_listener():
+    # drop cached data that the bot changes
+    await listen_for_cache_invalidations()
+
+
 @app.after_serving
 async def close_db_pool():
-    await db.pool.close()
+    # also closes the listener connection
+    await db.close()
     db.pool.terminate()
 
 
+# --------------------------- GMAIL --------------------------- #
+@app.before_serving
+async def start_google_http_client():
+    await GoogleHttpClient().start()
+
+
+@app.after_serving
+async def close_google_http_client():
+    await GoogleHttpClient().close()
+
+
+@app.before_serving
+async def load_gmail_discovery_document():
+    try:
+        await preload_gmail_api()
+    except Exception:
+        logger.warning('Failed to preload gmail discovery document', exc_info=True)
+
+
+# ---------------------------- BOT ---------------------------- #
+@app.after_serving
+async def close_event_forwarder():
+    await event_forwarder.close()
+
+
 # ---------------------------- RUN ---------------------------- #
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True, port=int(os.getenv('website_port')))
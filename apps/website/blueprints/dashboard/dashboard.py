@@ -5,6 +5,7 @@ from quart import (
 )
 
 from notilib import (
+    Database,
     EmailNotificationFilters,
     get_all_email_addresses,
     remove_email_address
@@ -38,28 +39,30 @@ def redact_email_address(email_address: str) -> str:
 
 
 async def _build_email_accounts_data(user_id: int) -> list[dict]:
-    all_email_addresses = await get_all_email_addresses(user_id)
-    email_accounts_data = []
-
-    for email_address in all_email_addresses:
-        filters = EmailNotificationFilters(
-            user_id, email_address['email_address'], email_address['webmail_service'])
-
-
-        email_account_data = {
-            'webmail_service': email_address['webmail_service'],
-            'email_address': email_address['email_address'],
-            'valid': email_address['valid'],
-            'email_address_redacted': redact_email_address(email_address['email_address']),
-            'sender_whitelist': {
-                'enabled': await filters.sender_whitelist_enabled,
-                'whitelisted_senders': await filters.whitelisted_senders
-            },
-            'sender_blacklist': {
-                'blacklisted_senders': await filters.blacklisted_senders
+    # use a single connection for all of the queries
+    async with Database().scope():
+        all_email_addresses = await get_all_email_addresses(user_id)
+        email_accounts_data = []
+
+        for email_address in all_email_addresses:
+            filters = EmailNotificationFilters(
+                user_id, email_address['email_address'], email_address['webmail_service'])
+
+
+            email_account_data = {
+                'webmail_service': email_address['webmail_service'],
+                'email_address': email_address['email_address'],
+                'valid': email_address['valid'],
+                'email_address_redacted': redact_email_address(email_address['email_address']),
+                'sender_whitelist': {
+                    'enabled': await filters.sender_whitelist_enabled,
+                    'whitelisted_senders': await filters.whitelisted_senders
+                },
+                'sender_blacklist': {
+                    'blacklisted_senders': await filters.blacklisted_senders
+                }
             }
-        }
-        email_accounts_data.append(email_account_data)
+            email_accounts_data.append(email_account_data)
 
     return email_accounts_data
 
@@ -154,13 +157,15 @@ async def edit_filtered_sender():
 
     filters = EmailNotificationFilters(user.id, email_address, webmail_service)
 
-    match sender_filter:
-        case 'whitelist':
-            await filters.remove_whitelisted_sender(sender_email_address_old)
-            await filters.add_whitelisted_sender(sender_email_address_new)
-        case 'blacklist':
-            await filters.remove_blacklisted_sender(sender_email_address_old)
-            await filters.add_blacklisted_sender(sender_email_address_new)
+    # replace the sender in a single transaction
+    async with Database().scope(transaction=True):
+        match sender_filter:
+            case 'whitelist':
+                await filters.remove_whitelisted_sender(sender_email_address_old)
+                await filters.add_whitelisted_sender(sender_email_address_new)
+            case 'blacklist':
+                await filters.remove_blacklisted_sender(sender_email_address_old)
+                await filters.add_blacklisted_sender(sender_email_address_new)
 
     return response_msg('edit_filtered_sender_success')
 
@@ -3,6 +3,7 @@ import logging
 from urllib.parse import urljoin
 from uuid import uuid4
 
+import asyncpg
 import jwt
 from aiogoogle import HTTPError
 from aiogoogle.auth import UserCreds
@@ -68,7 +69,7 @@ async def add_user_creds(
         await gmail.GmailEmailAddress(
             user.id, user_info.email).add_email_address(conn=conn)
         await gmail.save_user_credentials(user_info.email, user_creds, conn=conn)
-        await gmail.set_previous_email_ids(user_info.email, conn=conn)
+        await gmail.set_history_id(user_info.email, conn=conn)
 
         await gmail.set_credentials_validity(user_info.email, valid=True, conn=conn)
 
@@ -141,7 +142,8 @@ async def callback():
     await add_user_creds(user, user_info, user_creds)
 
     # watch inbox for new emails
-    await gmail.watch_user_inbox(user_creds=user_creds)
+    watch_expiration = await gmail.watch_user_inbox(user_creds=user_creds)
+    await gmail.set_watch_expiration(user_info.email, watch_expiration)
 
     return next_or_fallback()  # redirect user to home or next page
 
@@ -185,10 +187,10 @@ async def gmail_push():
         return {'success': False, 'reason': 'Expired JWT signature.'}
 
     try:
-        gmail_received_notify_user(await request.get_json())
-    except ConnectionRefusedError:
-        # bot is offline
-        logger.info('(`/gmail/push` failed) socket connection refused')
+        await gmail_received_notify_user(await request.get_json())
+    except (OSError, asyncpg.PostgresError):
+        # database is unavailable
+        logger.info('(`/gmail/push` failed) failed to queue event', exc_info=True)
         return {'success': False, 'reason': 'Internal server error'}, 500
 
     return {'success': True}
@@ -3,6 +3,7 @@ import logging
 from .discord.auth import *
 from .discord.info import *
 
+from .event_forwarder import *
 from .utils import *
 from .exceptions import *
 
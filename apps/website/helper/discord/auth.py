@@ -6,7 +6,7 @@ from aiohttp import ClientSession, ClientResponse
 from aiohttp_client_cache import CachedSession, SQLiteBackend
 from quart import Response as QuartResponse, redirect, session
 
-from notilib import create_account
+from notilib import SingleFlight, create_account
 from .info import get_discord_avatar
 from ..exceptions import InvalidDiscordAccessTokenError, UserNotLoggedInError
 
@@ -15,6 +15,9 @@ from ..exceptions import InvalidDiscordAccessTokenError, UserNotLoggedInError
 cache_backend = SQLiteBackend(
     cache_name='.cache/cache', expire_after=150, include_headers=True)
 
+# deduplicates concurrent refreshes of the same discord refresh token
+_token_refresh_flights = SingleFlight()
+
 
 class DiscordUserCreds:
     def __init__(self, creds_data: dict) -> None:
@@ -221,6 +224,26 @@ class DiscordOauthClient:
         return await _make_discord_token_endpoint_request(data)
 
 
+    async def __refresh_discord_access_token_once(
+        self,
+        refresh_token: str
+    ) -> ClientResponse:
+        """
+        Same as `refresh_discord_access_token`, but concurrent calls with the\
+            same refresh token share a single request (a refresh token can\
+            only be used once)
+        :param refresh_token: the refresh token to use in order to refresh\
+            the access token
+        """
+        async def refresh() -> ClientResponse:
+            response = await self.refresh_discord_access_token(refresh_token)
+            # read the body now so that every caller can read it
+            await response.read()
+            return response
+
+        return await _token_refresh_flights.run(refresh_token, refresh)
+
+
     async def authenticate_user(
         self,
         required_scopes: list[str]=['identify']
@@ -252,7 +275,7 @@ class DiscordOauthClient:
 
         # token is outdated or invalid, attempt to
         # refresh and update discord credentials in session cookie
-        response = await self.refresh_discord_access_token(refresh_token)
+        response = await self.__refresh_discord_access_token_once(refresh_token)
         await DiscordOauthClient.set_discord_user_creds(response, required_scopes)
 
         # refetch user using new access token
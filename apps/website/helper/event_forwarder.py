@@ -0,0 +1,131 @@
+import asyncio
+import logging
+
+from notilib import config, encode_frame
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventForwarder:
+    def __init__(self, host: str, port: int) -> None:
+        """
+        Forwards messages to the bot over a single persistent connection,\
+            reconnecting whenever it is lost.
+        Messages sent within a short window of each other are written\
+            together, and are pipelined (no reply is waited for).
+        :param host: the host of the bot event server
+        :param port: the port of the bot event server
+        """
+        self.host = host
+        self.port = port
+
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+        self._pending: list[tuple[bytes, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        # only one batch is written at a time
+        self._write_lock = asyncio.Lock()
+
+        # keep references to the flush tasks so they aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+
+    @property
+    def batch_window(self) -> float:
+        """How long to wait for more messages before writing (seconds)"""
+        return config('apps.website.event_forwarder.batch_window_ms') / 1000
+
+
+    async def send(self, message: dict) -> None:
+        """
+        Sends a message to the bot, returns once it has been written
+        :param message: the json serializable message to send
+        :raises ConnectionError: if the bot can't be connected to
+        """
+        loop = asyncio.get_running_loop()
+
+        future = loop.create_future()
+        self._pending.append((encode_frame(message), future))
+
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._schedule_flush)
+
+        await future
+
+
+    def _schedule_flush(self) -> None:
+        self._flush_handle = None
+
+        task = asyncio.create_task(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        # the bot closing the connection (for example on restart) shows up as eof
+        if self._writer is None or self._writer.is_closing() or self._reader.at_eof():
+            self._disconnect()
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            logger.info('Connected to the bot event server.')
+
+        return self._writer
+
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+        self._reader = None
+        self._writer = None
+
+
+    async def _write(self, data: bytes) -> None:
+        # a connection that has gone stale only fails once written to,
+        # so retry once on a fresh connection
+        for attempt in range(2):
+            try:
+                writer = await self._connect()
+                writer.write(data)
+                await writer.drain()
+                return
+            except OSError:  # includes `ConnectionError`
+                self._disconnect()
+                if attempt == 1:
+                    raise
+
+
+    async def _flush(self) -> None:
+        async with self._write_lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            try:
+                await self._write(b''.join(frame for frame, _ in pending))
+            except OSError as exc:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(None)
+
+
+    async def close(self) -> None:
+        """Writes any pending messages and closes the connection"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        try:
+            await self._flush()
+        finally:
+            self._disconnect()
+
+
+event_forwarder = EventForwarder('bot', config('apps.bot.socket_port'))
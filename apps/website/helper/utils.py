@@ -1,6 +1,6 @@
 import os
 import json
-import socket
+import logging
 from base64 import b64decode
 from typing import Any, TypedDict
 from urllib.parse import unquote as urlunquote
@@ -21,9 +21,12 @@ from quart import (
 from quart.sessions import SecureCookieSessionInterface
 
 from .discord.auth import DiscordUser, discord_auth_client
-from notilib import config, MISSING
+from .event_forwarder import event_forwarder
+from notilib import MISSING, enqueue_event
 
 
+logger = logging.getLogger(__name__)
+
 APP_PATH = os.path.abspath(f'{__file__}/../..')
 
 
@@ -45,29 +48,29 @@ def decrypt_session_cookie(session_cookie: str=None) -> dict | Any:
 
 
 # i couldn't figure out what the f to name this function
-def gmail_received_notify_user(res_data: dict) -> None:
+async def gmail_received_notify_user(res_data: dict) -> None:
     data = res_data.get('message', {}).get('data')
     if not data:
         return
 
     decoded_data: dict = json.loads(b64decode(data).decode())
     email_address: str = decoded_data.get('emailAddress')
+    history_id: int = decoded_data.get('historyId')
 
     if email_address is not None:
-        # build and convert data to string
-        json_data = json.dumps({
-            'action': 'dispatch_event',
-            'event_name': 'gmail_email_receive',
-            'kwargs': {
-                'email_address': email_address
-            }
-        })
-
-        # send data to the bot through a socket in order to dispatch
-        # an event and notify the user
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-            client.connect(('bot', config('apps.bot.socket_port')))
-            client.send(json_data.encode())
+        # queue an event for the bot to notify the user with, the queue
+        # keeps it until the bot has handled it (even if the bot is down)
+        event_id = await enqueue_event(
+            'gmail_email_receive',
+            {'email_address': email_address, 'history_id': history_id}
+        )
+
+        # let the bot handle the event right away, if it can't be reached
+        # the event is picked up by its queue consumers later instead
+        try:
+            await event_forwarder.send({'action': 'dispatch_queued_event', 'event_id': event_id})
+        except OSError:
+            logger.info(f'Failed to forward queued event {event_id} to the bot')
 
 
 class ResponseMsg(TypedDict):
@@ -7,12 +7,17 @@ from .loggers.utils import *
 
 from .accounts import *
 from .account_manager import *
+from .cache import *
 from .common import *
+from .concurrency import *
 from .database import *
 from .email_addresses import *
+from .event_queue import *
 from .exceptions import *
 from .filters import *
+from .framing import *
 from .functions import *
+from .migrations import *
 from .permissions import *
 
 from .email_clients import *
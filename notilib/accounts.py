@@ -5,6 +5,7 @@ from typing import NamedTuple
 
 from asyncpg import Connection
 
+from .cache import AsyncCache, cached, invalidate_everywhere
 from .functions import create_query_placeholders
 from .database import ensure_connection
 from .exceptions import ConfirmationError
@@ -19,6 +20,17 @@ class AccountDataTuple(NamedTuple):
     blacklisted: int
 
 
+# account data by discord id
+accounts_cache = AsyncCache('accounts')
+
+
+def _copy_account_data(account_data: AccountDataTuple | None) -> AccountDataTuple | None:
+    # the permissions list is modified by callers such as `add_permission`
+    if account_data is None or account_data.permissions is None:
+        return account_data
+    return account_data._replace(permissions=list(account_data.permissions))
+
+
 @ensure_connection
 async def create_account(
     discord_id: int,
@@ -70,6 +82,7 @@ async def create_account(
         f'INSERT INTO accounts ({column_names}) VALUES ({placeholders})',
         *tuple(data.values())
     )
+    await invalidate_everywhere(accounts_cache, discord_id, conn=conn)
     return True
 
 
@@ -92,6 +105,7 @@ async def delete_account(
             'Param `confirm` must be `True` in order to delete an account!')
 
     await conn.execute('DELETE FROM accounts WHERE discord_id = $1', discord_id)
+    await invalidate_everywhere(accounts_cache, discord_id, conn=conn)
 
 
 async def __select_account_data(discord_id: int, conn: Connection):
@@ -100,20 +114,32 @@ async def __select_account_data(discord_id: int, conn: Connection):
         'FROM accounts WHERE discord_id = $1', discord_id)
 
 
+@cached(accounts_cache, key=lambda discord_id: discord_id, copy=_copy_account_data)
 @ensure_connection
+async def __get_account_data(
+    discord_id: int,
+    conn: Connection=None
+) -> AccountDataTuple | None:
+    account_data = await __select_account_data(discord_id, conn)
+
+    if account_data is None:
+        return None
+    return AccountDataTuple(*account_data)
+
+
 async def get_account(
     discord_id: int,
     create: bool=False,
     conn: Connection=None
 ) -> AccountDataTuple | None:
     """
-    Gets the account data for a user
+    Gets the account data for a user, account data is cached (see `accounts_cache`)
     :param discord_id: the discord id of the user to get the account data for
     :param create: if an account should be created if one does not already exists
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    account_data = await __select_account_data(discord_id, conn=conn)
+    account_data = await __get_account_data(discord_id, conn=conn)
 
     if account_data is None:
         # return no data if "create if not exists" is False
@@ -122,10 +148,9 @@ async def get_account(
 
         # create account and select account data
         await create_account(discord_id, conn=conn)
-        account_data = await __select_account_data(discord_id, conn)
+        account_data = await __get_account_data(discord_id, conn=conn)
 
-    # return account data tuple as a named tuple
-    return AccountDataTuple(*account_data)
+    return account_data
 
 
 @ensure_connection
@@ -154,3 +179,4 @@ async def set_account_blacklist(
     await conn.execute(
         'UPDATE accounts SET blacklisted = $1 WHERE discord_id = $2',
         blacklisted, discord_id)
+    await invalidate_everywhere(accounts_cache, discord_id, conn=conn)
@@ -0,0 +1,371 @@
+"""In memory caching of database reads"""
+
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Protocol, TypeVar
+
+from asyncpg import Connection
+
+from .concurrency import SingleFlight
+from .database import Database, ensure_connection, hashing_key, scoped_connection
+from .functions import config
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_MISSING = object()
+
+# channel that cache invalidations are sent on, so that every process drops
+# the invalidated keys (see `invalidate_everywhere`)
+CACHE_INVALIDATION_CHANNEL = 'cache_invalidation'
+
+# notification payloads are limited to 8000 bytes
+_MAX_TOKENS_PER_NOTIFICATION = 100
+
+
+class InvalidatableCache(Protocol):
+    name: str
+
+    def invalidate(self, *keys: Hashable) -> None: ...
+
+    def invalidate_tokens(self, tokens: list[str]) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+# every cache by name
+_caches: dict[str, InvalidatableCache] = {}
+
+
+def cache_key_token(key: Hashable) -> str:
+    """
+    Returns the keyed hash of a cache key, which identifies the key in\
+        invalidation notifications without revealing it (keys can contain\
+        email addresses)
+    :param key: the cache key to hash
+    """
+    return hmac.new(
+        hashing_key().encode(), repr(key).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def register_cache(cache: InvalidatableCache) -> None:
+    """
+    Registers a cache so that invalidations sent by other processes are applied to it
+    :param cache: the cache to register, its name must be unique
+    """
+    _caches[cache.name] = cache
+
+
+class AsyncCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float | None=None,
+        max_size: int | None=None
+    ) -> None:
+        """
+        Caches the results of async functions for `ttl` seconds, keeping at most\
+            `max_size` of them by evicting the least recently used.
+        Concurrent loads of the same key share a single call, and loads that\
+            were running while the cache was invalidated don't store their\
+            (possibly outdated) results.
+        :param name: the name of the cache, also used to look up its defaults\
+            in the `global.cache` config
+        :param ttl: how long results are cached for (seconds)
+        :param max_size: the max amount of results to cache
+        """
+        self.name = name
+        self.ttl = ttl if ttl is not None else config(f'global.cache.{name}.ttl_seconds')
+        self.max_size = max_size if max_size is not None \
+            else config(f'global.cache.{name}.max_size')
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (expires at, value, token), ordered from least to most recently used
+        self._entries: OrderedDict[Hashable, tuple[float, Any, str]] = OrderedDict()
+        self._flights = SingleFlight()
+
+        # token -> key, of every cached key
+        self._tokens: dict[str, Hashable] = {}
+
+        # incremented by every invalidation
+        self._generation = 0
+
+        register_cache(self)
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._tokens.pop(entry[2], None)
+
+
+    def _get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        return value
+
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        """
+        Returns the cached value of a key
+        :param key: the key to get the value of
+        :param default: what to return if the key isn't cached
+        """
+        value = self._get(key)
+        return default if value is _MISSING else value
+
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Caches the value of a key
+        :param key: the key to cache the value of
+        :param value: the value to cache
+        """
+        token = cache_key_token(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, value, token)
+        self._entries.move_to_end(key)
+        self._tokens[token] = key
+
+        while len(self._entries) > self.max_size:
+            _, (_, _, evicted_token) = self._entries.popitem(last=False)
+            self._tokens.pop(evicted_token, None)
+            self.evictions += 1
+
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        Removes keys from the cache, should be called after any write that\
+            changes their values
+        :param keys: the keys to remove
+        """
+        self._generation += 1
+
+        for key in keys:
+            self._remove(key)
+
+
+    def invalidate_tokens(self, tokens: list[str]) -> None:
+        """
+        Removes keys from the cache by their tokens (see `cache_key_token`)
+        :param tokens: the tokens of the keys to remove
+        """
+        self._generation += 1
+
+        for token in tokens:
+            key = self._tokens.get(token, _MISSING)
+            if key is not _MISSING:
+                self._remove(key)
+
+
+    def clear(self) -> None:
+        """Removes every key from the cache"""
+        self._generation += 1
+        self._entries.clear()
+        self._tokens.clear()
+
+
+    async def load(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        **kwargs
+    ) -> T:
+        """
+        Calls `func(*args, **kwargs)` and caches its result under `key`, unless\
+            the cache is invalidated while it runs
+        :param key: the key to cache the result under
+        :param func: the async function to load the value with
+        """
+        generation = self._generation
+        value = await func(*args, **kwargs)
+
+        if generation == self._generation:
+            self.set(key, value)
+        return value
+
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        **kwargs
+    ) -> T:
+        """
+        Returns the cached value of a key, loading it with `func(*args, **kwargs)`\
+            if it isn't cached. Concurrent loads of the same key share one call.
+        :param key: the key to get the value of
+        :param func: the async function to load the value with
+        """
+        value = self._get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+
+        # loads started after an invalidation don't join ones started before it
+        return await self._flights.run(
+            (key, self._generation), self.load, key, func, *args, **kwargs)
+
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+def cached(
+    cache: AsyncCache,
+    key: Callable[..., Hashable],
+    copy: Callable[[T], T] | None=None
+) -> Callable:
+    """
+    Caches the results of a function that takes a `conn` keyword argument.\
+        Calls made with a connection (passed or from `Database().scope()`)\
+        that is in a transaction skip the cache, since they may see (or have\
+        made) changes that aren't committed.
+    Should be applied above `@ensure_connection`, so that cache hits don't\
+        acquire a connection.
+    :param cache: the cache to store the results in
+    :param key: called with the arguments of each call (excluding `conn`) to\
+        get the key to cache its result under
+    :param copy: called on every returned value, for results that callers\
+        may modify
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args, conn: Connection=None, **kwargs) -> T:
+            conn = conn or scoped_connection()
+
+            if conn is not None and conn.is_in_transaction():
+                return await func(*args, conn=conn, **kwargs)
+
+            cache_key = key(*args, **kwargs)
+
+            if conn is None:
+                value = await cache.get_or_load(cache_key, func, *args, **kwargs)
+            else:
+                # the caller's connection can't be shared with other callers
+                value = cache.get(cache_key, _MISSING)
+                if value is _MISSING:
+                    cache.misses += 1
+                    value = await cache.load(cache_key, func, *args, conn=conn, **kwargs)
+                else:
+                    cache.hits += 1
+
+            return copy(value) if copy is not None else value
+        return wrapper
+    return decorator
+
+
+@ensure_connection
+async def invalidate_everywhere(
+    cache: InvalidatableCache,
+    *keys: Hashable,
+    conn: Connection=None
+) -> None:
+    """
+    Removes keys from a cache in this process right away, and in every\
+        process listening for cache invalidations (this one included) once the\
+        current transaction of `conn` commits, since the old values can be\
+        cached again by reads that happen before the commit. Should be called\
+        after the write that changes the values of the keys.
+    :param cache: the cache to remove the keys from
+    :param keys: the keys to remove
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    cache.invalidate(*keys)
+
+    tokens = [cache_key_token(key) for key in keys]
+
+    for i in range(0, len(tokens), _MAX_TOKENS_PER_NOTIFICATION):
+        await conn.execute(
+            'SELECT pg_notify($1, $2)', CACHE_INVALIDATION_CHANNEL,
+            json.dumps({
+                'cache': cache.name,
+                'tokens': tokens[i:i + _MAX_TOKENS_PER_NOTIFICATION]
+            })
+        )
+
+
+def _on_cache_invalidation(_conn, _pid, _channel, payload: str) -> None:
+    try:
+        data = json.loads(payload)
+        cache = _caches.get(data['cache'])
+        tokens = data['tokens']
+    except (ValueError, KeyError):
+        logger.warning(f'Received invalid cache invalidation: {payload}')
+        return
+
+    if cache is not None:
+        cache.invalidate_tokens(tokens)
+
+
+def clear_all_caches() -> None:
+    """Removes every key from every cache"""
+    for cache in _caches.values():
+        cache.clear()
+
+
+# whether `listen_for_cache_invalidations` has been called
+_listening = False
+
+
+async def listen_for_cache_invalidations() -> None:
+    """
+    Applies the cache invalidations sent by every process to the caches of\
+        this one, should be called once on startup by each app
+    """
+    global _listening
+    if _listening:
+        return
+    _listening = True
+
+    # invalidations sent while the listener was reconnecting are lost
+    await Database().add_listener(
+        CACHE_INVALIDATION_CHANNEL, _on_cache_invalidation, on_reconnect=clear_all_caches)
+
+
+def get_cache(name: str) -> InvalidatableCache | None:
+    """
+    Returns a cache by its name
+    :param name: the name of the cache
+    """
+    return _caches.get(name)
+
+
+def get_cache_stats() -> dict[str, dict]:
+    """Returns the size and hit / miss counters of every cache"""
+    return {
+        name: cache.stats() for name, cache in _caches.items()
+        if isinstance(cache, AsyncCache)
+    }
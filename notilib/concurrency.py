@@ -0,0 +1,93 @@
+"""Helpers for running coroutines concurrently"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+
+T = TypeVar('T')
+
+
+async def gather_with_concurrency(
+    limit: int,
+    *aws: Awaitable,
+    return_exceptions: bool=False
+) -> list[Any]:
+    """
+    Same as `asyncio.gather`, but with at most `limit` awaitables running\
+        at the same time. Results are returned in the order they were passed in.
+    :param limit: the max amount of awaitables to run at the same time
+    :param aws: the awaitables to run
+    :param return_exceptions: whether to return exceptions as results instead\
+        of raising the first one
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable) -> Any:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(
+        *(run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        """
+        Deduplicates concurrent calls by key. While a call for a key is\
+            running, any other call for the same key waits for and shares\
+            its result instead of running again.
+        """
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+    async def run(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        **kwargs
+    ) -> T:
+        """
+        Runs `func(*args, **kwargs)` unless a call for the same key is already\
+            running, in which case the result of that call is returned
+        :param key: the key to deduplicate calls by
+        :param func: the async function to call
+        """
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # shielded so that a cancelled caller doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+
+class RateLimiter:
+    def __init__(self, rate: float) -> None:
+        """
+        Spaces calls out evenly so that at most `rate` of them start per second
+        :param rate: the max amount of calls per second
+        """
+        self.interval = 1 / rate
+        self._next_at = 0.0
+
+
+    async def wait(self, cost: int=1) -> None:
+        """
+        Waits until the next call is allowed to start
+        :param cost: how many calls the call counts as (for example the\
+            amount of calls in a batch request)
+        """
+        now = asyncio.get_running_loop().time()
+
+        delay = self._next_at - now
+        self._next_at = max(now, self._next_at) + self.interval * cost
+
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -2,9 +2,15 @@
 
 
 import os
+import asyncio
+import contextvars
+import hmac
+import hashlib
+import inspect
 import logging
+from contextlib import asynccontextmanager
 from functools import wraps
-from typing import Any, Coroutine
+from typing import Any, AsyncIterator, Callable, Coroutine
 
 import asyncpg
 from dotenv import load_dotenv; load_dotenv()
@@ -15,16 +21,58 @@ from .common import PROJECT_PATH
 logger = logging.getLogger(__name__)
 
 
+# the connection pinned by `Database().scope()` and the task that pinned it
+_scope: contextvars.ContextVar[tuple[asyncpg.Connection, asyncio.Task] | None] = \
+    contextvars.ContextVar('database_scope', default=None)
+
+
+def scoped_connection() -> asyncpg.Connection | None:
+    """
+    Returns the connection pinned by `Database().scope()` in the current task.
+    Tasks created within a scope inherit its context but not its connection,\
+        since a connection can only run one query at a time.
+    """
+    scope = _scope.get()
+    if scope is None:
+        return None
+
+    conn, task = scope
+    if task is not asyncio.current_task():
+        return None
+    return conn
+
+
 def ensure_connection(func):
     """
     Decorator that ensures a database connection is resolved.
-    If the `conn` parameter is `None`, a new connection will be acquired,
-    otherwise the passed `conn` parameter connection will be used.
+    If the `conn` parameter is `None`, the connection of the current\
+        `Database().scope()` is used, or if there is none a new connection\
+        will be acquired, otherwise the passed `conn` parameter connection will be used.
+    Async generators hold the acquired connection until they are exhausted or closed.
     """
+    if inspect.isasyncgenfunction(func):
+        @wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            conn = kwargs.get('conn') or scoped_connection()
+            if conn:  # use provided connection
+                kwargs['conn'] = conn
+                async for item in func(*args, **kwargs):
+                    yield item
+                return
+
+            pool = await Database().connect()
+
+            async with pool.acquire() as conn:  # otherwise, acquire new connection
+                kwargs['conn'] = conn
+                async for item in func(*args, **kwargs):
+                    yield item
+        return generator_wrapper
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        conn = kwargs.get('conn')
+        conn = kwargs.get('conn') or scoped_connection()
         if conn:  # use provided connection
+            kwargs['conn'] = conn
             return await func(*args, **kwargs)
 
         pool = await Database().connect()
@@ -35,6 +83,22 @@ def ensure_connection(func):
     return wrapper
 
 
+def hashing_key() -> str:
+    """Returns the secret key used to hash email addresses for lookups"""
+    return os.getenv('database_hashing_key') or os.getenv('database_encryption_key')
+
+
+def hash_email_address(email_address: str) -> bytes:
+    """
+    Returns the keyed hash (HMAC-SHA256) of an email address.
+    Email addresses are stored encrypted with a non deterministic ciphertext, so
+    this hash is stored alongside them and used to look rows up by email address
+    :param email_address: the email address to hash
+    """
+    return hmac.new(
+        hashing_key().encode(), email_address.encode(), hashlib.sha256).digest()
+
+
 def _load_sql_from_file(filename: str):
     with open(f'{PROJECT_PATH}/schema/{filename}') as file:
         return file.read()
@@ -79,6 +143,120 @@ class Database:
         return self.pool
 
 
+    # dedicated connection for `LISTEN` (pooled connections drop their
+    # listeners when they are released), and the callbacks per channel
+    _listener_conn: asyncpg.Connection = None
+    _listeners: dict[str, list[Callable]] = {}
+    _reconnect_task: asyncio.Task = None
+
+    # called after reconnecting, since notifications sent meanwhile are lost
+    _reconnect_callbacks: list[Callable[[], Any]] = []
+
+
+    async def _connect_listener(self) -> asyncpg.Connection:
+        if self._listener_conn is None or self._listener_conn.is_closed():
+            self._listener_conn = await asyncpg.connect(
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                user=self.user,
+                password=self.password
+            )
+            self._listener_conn.add_termination_listener(self._on_listener_terminated)
+
+            # listen again on a new connection
+            for channel, callbacks in self._listeners.items():
+                for callback in callbacks:
+                    await self._listener_conn.add_listener(channel, callback)
+
+            logger.info("Created new database listener connection.")
+        return self._listener_conn
+
+
+    def _on_listener_terminated(self, conn: asyncpg.Connection) -> None:
+        if not self._listeners:
+            return
+
+        async def reconnect() -> None:
+            while True:
+                try:
+                    await self._connect_listener()
+                    break
+                except (OSError, asyncpg.PostgresError):
+                    logger.warning('Failed to reconnect database listener', exc_info=True)
+                    await asyncio.sleep(5)
+
+            for callback in self._reconnect_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.error('Database listener reconnect callback failed', exc_info=True)
+
+        logger.warning('Database listener connection lost, reconnecting.')
+        self._reconnect_task = asyncio.create_task(reconnect())
+
+
+    async def add_listener(
+        self,
+        channel: str,
+        callback: Callable,
+        on_reconnect: Callable[[], Any] | None=None
+    ) -> None:
+        """
+        Calls `callback(connection, pid, channel, payload)` whenever a\
+            notification is sent on `channel` (with `NOTIFY` or `pg_notify()`)
+        :param channel: the channel to listen on
+        :param callback: the function to call for each notification
+        :param on_reconnect: called after the listener connection has been\
+            re-established, notifications sent while it was down are lost
+        """
+        conn = await self._connect_listener()
+
+        self._listeners.setdefault(channel, []).append(callback)
+        await conn.add_listener(channel, callback)
+
+        if on_reconnect is not None:
+            self._reconnect_callbacks.append(on_reconnect)
+
+
+    @asynccontextmanager
+    async def scope(self, transaction: bool=False) -> AsyncIterator[asyncpg.Connection]:
+        """
+        Pins a single connection that every function decorated with\
+            `@ensure_connection` uses when called without `conn` in the current\
+            task, instead of each acquiring their own. Nested scopes reuse the\
+            connection of the outer scope.
+        ```
+        async with Database().scope(transaction=True):
+            await remove_email_address(...)
+            await add_email_address(...)
+        ```
+        :param transaction: whether to run the scope in a transaction (a\
+            savepoint if the outer scope is in a transaction already)
+        """
+        conn = scoped_connection()
+        if conn is not None:
+            if transaction:
+                async with conn.transaction():
+                    yield conn
+            else:
+                yield conn
+            return
+
+        pool = await self.connect()
+
+        async with pool.acquire() as conn:
+            token = _scope.set((conn, asyncio.current_task()))
+            try:
+                if transaction:
+                    async with conn.transaction():
+                        yield conn
+                else:
+                    yield conn
+            finally:
+                _scope.reset(token)
+
+
     async def connect(self) -> asyncpg.Pool:
         if self.pool is None or self.pool._closed:
             await self._create_pool()
@@ -87,6 +265,12 @@ class Database:
 
 
     async def close(self):
+        if self._listener_conn is not None and not self._listener_conn.is_closed():
+            self._listeners.clear()
+            self._reconnect_callbacks.clear()
+            await self._listener_conn.close()
+            logger.info("Closed the database listener connection.")
+
         if self.pool:
             await self.pool.close()
             logger.info("Closed the database connection pool.")
@@ -2,10 +2,50 @@ import os
 
 from asyncpg import Connection
 
+from .cache import AsyncCache, cached, invalidate_everywhere
 from .common import WebmailServiceLiteral
-from .database import ensure_connection
+from .database import ensure_connection, hash_email_address
+from .filters import subscriber_filters_cache
 
 
+# email addresses by (discord id, webmail service)
+email_addresses_cache = AsyncCache('email_addresses')
+
+# discord ids by (email address hash, webmail service)
+email_address_subscribers_cache = AsyncCache('email_address_subscribers')
+
+
+async def invalidate_email_address_caches(
+    discord_id: int,
+    email_address: str,
+    webmail_service: WebmailServiceLiteral,
+    conn: Connection
+) -> None:
+    """
+    Removes the cached data affected by connecting or disconnecting an email\
+        address, in every process
+    :param discord_id: the discord id of the user
+    :param email_address: the email address that was (dis)connected
+    :param webmail_service: the webmail service of the email address
+    :param conn: the connection that the email address was (dis)connected on
+    """
+    email_address_hash = hash_email_address(email_address)
+
+    await invalidate_everywhere(
+        email_addresses_cache, (discord_id, webmail_service), conn=conn)
+    await invalidate_everywhere(
+        email_address_subscribers_cache, (email_address_hash, webmail_service), conn=conn)
+    await invalidate_everywhere(
+        subscriber_filters_cache, (discord_id, email_address_hash, webmail_service),
+        conn=conn
+    )
+
+
+@cached(
+    email_addresses_cache,
+    key=lambda discord_id, webmail_service: (discord_id, webmail_service),
+    copy=list
+)
 @ensure_connection
 async def get_email_addresses(
     discord_id: int,
@@ -36,8 +76,8 @@ async def __are_credentials_valid(
 ) -> bool:
     is_valid: bool = await conn.fetchval(
         f'SELECT valid FROM {webmail_service}_credentials '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $1',
-        email_address, os.getenv('database_encryption_key')
+        'WHERE email_address_hash = $1',
+        hash_email_address(email_address)
     )
     return is_valid
 
@@ -89,19 +129,27 @@ async def add_email_address(
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    current_email_addresses = await get_email_addresses(
-        discord_id, webmail_service=webmail_service, conn=conn)
+    # checked against the database rather than the cached email addresses,
+    # which can be stale
+    already_added = await conn.fetchval(
+        'SELECT EXISTS(SELECT 1 FROM email_notification_filters '
+        'WHERE discord_id = $1 AND email_address_hash = $2 AND webmail_service = $3)',
+        discord_id, hash_email_address(email_address), webmail_service
+    )
 
-    if email_address in current_email_addresses:
+    if already_added:
         # email address already added
         return
 
     await conn.execute(
         'INSERT INTO email_notification_filters '
-        '(discord_id, email_address, webmail_service) '
-        "VALUES ($1, pgp_sym_encrypt($2, $4), $3)",
-        discord_id, email_address, webmail_service, os.getenv('database_encryption_key')
+        '(discord_id, email_address, email_address_hash, webmail_service) '
+        "VALUES ($1, pgp_sym_encrypt($2, $5), $3, $4)",
+        discord_id, email_address, hash_email_address(email_address),
+        webmail_service, os.getenv('database_encryption_key')
     )
+    await invalidate_email_address_caches(
+        discord_id, email_address, webmail_service, conn=conn)
 
 @ensure_connection
 async def remove_email_address(
@@ -119,12 +167,19 @@ async def remove_email_address(
     """
     await conn.execute(
         "DELETE FROM email_notification_filters WHERE discord_id = $1 "
-        "AND pgp_sym_decrypt(email_address, $4) = $2 AND webmail_service = $3",
-        discord_id, email_address, webmail_service,
-        os.getenv('database_encryption_key')
+        "AND email_address_hash = $2 AND webmail_service = $3",
+        discord_id, hash_email_address(email_address), webmail_service
     )
+    await invalidate_email_address_caches(
+        discord_id, email_address, webmail_service, conn=conn)
 
 
+@cached(
+    email_address_subscribers_cache,
+    key=lambda email_address, webmail_service: (
+        hash_email_address(email_address), webmail_service),
+    copy=list
+)
 @ensure_connection
 async def email_address_to_discord_ids(
     email_address: str,
@@ -139,8 +194,8 @@ async def email_address_to_discord_ids(
     """
     rows = await conn.fetch(
         'SELECT discord_id FROM email_notification_filters '
-        "WHERE pgp_sym_decrypt(email_address, $3) = $1 AND webmail_service = $2",
-        email_address, webmail_service, os.getenv('database_encryption_key')
+        "WHERE email_address_hash = $1 AND webmail_service = $2",
+        hash_email_address(email_address), webmail_service
     )
 
     return [row['discord_id'] for row in rows]
@@ -1,7 +1,10 @@
 """Gmail email client and utilities"""
 
+from .batch import *
 from .credentials import *
+from .discovery import *
 from .email_addresses import *
 from .emails import *
+from .sessions import *
 from .utils import *
 from .watch import *
@@ -0,0 +1,236 @@
+"""Helpers for gmail api batch requests (https://developers.google.com/gmail/api/guides/batch)"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Iterable, NamedTuple
+from uuid import uuid4
+
+from aiohttp import ClientResponse, MultipartReader
+
+from .sessions import GoogleHttpClient
+
+
+BATCH_URL = 'https://www.googleapis.com/batch/gmail/v1'
+
+# gmail allows at most 100 calls per batch request
+MAX_CALLS_PER_BATCH = 100
+
+# statuses of batched calls that are worth retrying
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+class BatchRequestPart(NamedTuple):
+    """A single call of a batch request"""
+    content_id: str
+    method: str
+    url: str
+    access_token: str
+    body: bytes = b''
+    content_type: str = 'application/json'
+
+
+def build_batch_request_part(
+    method: str,
+    url: str,
+    access_token: str,
+    data: dict | None=None
+) -> BatchRequestPart:
+    """
+    Builds a call for a batch request, each call has its own authorization,\
+        so calls for different users can be sent in the same batch
+    :param method: the http method of the call
+    :param url: the url of the call, including any query parameters
+    :param access_token: the oauth2 access token of the user to make the call as
+    :param data: the json body of the call
+    """
+    body = json.dumps(data).encode() if data is not None else b''
+    return BatchRequestPart(str(uuid4()), method, url, access_token, body)
+
+
+def build_batch_request_body(
+    parts: Iterable[BatchRequestPart],
+    boundary: str
+) -> bytes:
+    """
+    Builds the `multipart/mixed` body of a batch request
+    :param parts: the calls to include in the batch
+    :param boundary: the boundary that separates the calls
+    """
+    delimiter = f'--{boundary}\r\n'.encode()
+    buffer = bytearray()
+
+    for part in parts:
+        buffer += delimiter
+        buffer += (
+            'Content-Type: application/http\r\n'
+            f'Content-ID: {part.content_id}\r\n'
+            '\r\n'
+            f'{part.method} {part.url}\r\n'
+            f'Authorization: Bearer {part.access_token}\r\n'
+        ).encode()
+
+        if part.body:
+            buffer += (
+                f'Content-Type: {part.content_type}\r\n'
+                f'Content-Length: {len(part.body)}\r\n'
+            ).encode()
+
+        buffer += b'\r\n'
+        buffer += part.body
+        buffer += b'\r\n'
+
+    buffer += f'--{boundary}--\r\n'.encode()
+    return bytes(buffer)
+
+
+class BatchResponsePart(NamedTuple):
+    """The response to a single call of a batch request"""
+    content_id: str
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    @property
+    def transient(self) -> bool:
+        """Whether the call failed in a way that is worth retrying"""
+        return self.status in TRANSIENT_STATUSES
+
+    def json(self) -> dict:
+        return json.loads(self.body) if self.body else {}
+
+
+def _parse_content_id(content_id: str) -> str:
+    # responses are labelled `<response-{content id of the call}>`
+    content_id = content_id.strip().strip('<>')
+    return content_id.removeprefix('response-')
+
+
+def _parse_http_response(content_id: str, data: bytes) -> BatchResponsePart:
+    head, _, body = data.lstrip().partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode().split('\r\n')
+
+    headers = {}
+    for header_line in header_lines:
+        name, _, value = header_line.partition(':')
+        headers[name.strip()] = value.strip()
+
+    # `HTTP/1.1 200 OK`
+    status = int(status_line.split(' ')[1])
+
+    return BatchResponsePart(content_id, status, headers, body)
+
+
+async def parse_batch_response(
+    response: ClientResponse
+) -> AsyncIterator[BatchResponsePart]:
+    """
+    Yields the response of each call in a `multipart/mixed` batch response\
+        as it is read from the connection
+    :param response: the response to the batch request
+    """
+    reader = MultipartReader.from_response(response)
+
+    while (part := await reader.next()) is not None:
+        content_id = _parse_content_id(part.headers.get('Content-ID', ''))
+        yield _parse_http_response(content_id, await part.read())
+
+
+async def send_batch_request(
+    parts: list[BatchRequestPart],
+    boundary: str='batch_gmail'
+) -> dict[str, BatchResponsePart]:
+    """
+    Sends calls as a single batch request over the shared google session
+    :param parts: the calls to send (at most `MAX_CALLS_PER_BATCH`)
+    :param boundary: the boundary that separates the calls
+
+    :return: the response of each call by its content id, calls that didn't\
+        get a response are left out
+    :raises aiohttp.ClientError: if the batch request itself fails
+    """
+    session = GoogleHttpClient().session_factory()
+
+    async with session.post(
+        url=BATCH_URL,
+        headers={'Content-Type': f'multipart/mixed; boundary={boundary}'},
+        data=build_batch_request_body(parts, boundary),
+        timeout=15
+    ) as response:
+        response.raise_for_status()
+
+        return {
+            part.content_id: part
+            async for part in parse_batch_response(response)
+        }
+
+
+class BatchCollector:
+    def __init__(self, delay: float, max_calls: int=MAX_CALLS_PER_BATCH) -> None:
+        """
+        Collects calls submitted from anywhere (for example for different\
+            users) for a short amount of time and sends them as one batch request
+        :param delay: how long to wait for more calls before sending (seconds)
+        :param max_calls: the amount of calls after which a batch is sent right away
+        """
+        self.delay = delay
+        self.max_calls = max_calls
+
+        self._pending: list[tuple[BatchRequestPart, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        # keep references to the sending tasks so they aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+
+    async def submit(self, part: BatchRequestPart) -> BatchResponsePart:
+        """
+        Adds a call to the next batch and waits for its response, a call\
+            that didn't get a response has a status of `0`
+        :param part: the call to send
+        :raises aiohttp.ClientError: if the batch request itself fails
+        """
+        loop = asyncio.get_running_loop()
+
+        future = loop.create_future()
+        self._pending.append((part, future))
+
+        if len(self._pending) >= self.max_calls:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.delay, self._flush)
+
+        return await future
+
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+
+        if pending:
+            task = asyncio.create_task(self._send(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+    async def _send(self, pending: list[tuple[BatchRequestPart, asyncio.Future]]) -> None:
+        try:
+            responses = await send_batch_request([part for part, _ in pending])
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for part, future in pending:
+            if future.done():  # the caller stopped waiting
+                continue
+
+            future.set_result(
+                responses.get(part.content_id, BatchResponsePart(part.content_id, 0, {}, b'')))
@@ -1,14 +1,18 @@
 import os
 import json
 import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, NamedTuple
 
 from aiogoogle import HTTPError
 from aiogoogle.auth import Oauth2Manager
 from aiogoogle.auth.creds import ClientCreds, UserCreds
 from asyncpg import Connection
 
+from ...cache import cache_key_token, invalidate_everywhere, register_cache
+from ...concurrency import SingleFlight, gather_with_concurrency
 from ...exceptions import InvalidRefreshTokenError
-from ...database import ensure_connection
+from ...database import ensure_connection, hash_email_address, scoped_connection
 from ...functions import config
 
 
@@ -23,6 +27,96 @@ client_creds = ClientCreds(
 oauth2 = Oauth2Manager(client_creds=client_creds)
 
 
+class MailboxCredentials(NamedTuple):
+    """The credentials of a mailbox along with its email address"""
+    email_address: str
+    user_creds: UserCreds
+
+
+def credentials_expire_at(user_creds: UserCreds) -> datetime | None:
+    """
+    Returns when the access token of the credentials expires (naive utc),\
+        or `None` if the expiry is unknown
+    :param user_creds: the credentials to get the expiry of
+    """
+    expires_at = user_creds.get('expires_at')
+    if expires_at is None:
+        return None
+
+    # aiogoogle stores `expires_at` as a naive utc iso timestamp
+    return datetime.fromisoformat(expires_at)
+
+
+class _CredentialsCache:
+    name = 'gmail_credentials'
+
+    def __init__(self, expiry_margin: timedelta=timedelta(minutes=1)) -> None:
+        """
+        Holds decrypted user credentials in memory until shortly before\
+            their access token expires
+        :param expiry_margin: how long before the access token expires to\
+            stop handing out the cached credentials
+        """
+        self.expiry_margin = expiry_margin
+        self._credentials: dict[str, UserCreds] = {}
+
+        # token (see `cache_key_token`) -> email address, of every cached email address
+        self._tokens: dict[str, str] = {}
+
+        register_cache(self)
+
+
+    def _is_usable(self, user_creds: UserCreds) -> bool:
+        expires_at = credentials_expire_at(user_creds)
+        if expires_at is None:
+            return False
+
+        return datetime.utcnow() + self.expiry_margin < expires_at
+
+
+    def get(self, email_address: str) -> UserCreds | None:
+        """Returns the cached credentials if they are still usable"""
+        user_creds = self._credentials.get(email_address)
+        if user_creds is None:
+            return None
+
+        if not self._is_usable(user_creds):
+            self.invalidate(email_address)
+            return None
+
+        return user_creds
+
+
+    def set(self, email_address: str, user_creds: UserCreds) -> None:
+        if self._is_usable(user_creds):
+            self._credentials[email_address] = user_creds
+            self._tokens[cache_key_token(email_address)] = email_address
+
+
+    def invalidate(self, *email_addresses: str) -> None:
+        for email_address in email_addresses:
+            if self._credentials.pop(email_address, None) is not None:
+                self._tokens.pop(cache_key_token(email_address), None)
+
+
+    def invalidate_tokens(self, tokens: list[str]) -> None:
+        for token in tokens:
+            email_address = self._tokens.pop(token, None)
+            if email_address is not None:
+                self._credentials.pop(email_address, None)
+
+
+    def clear(self) -> None:
+        self._credentials.clear()
+        self._tokens.clear()
+
+
+_credentials_cache = _CredentialsCache()
+
+# deduplicates concurrent refreshes of the same credentials
+_refresh_flights = SingleFlight()
+
+
 @ensure_connection
 async def __find_user_credentials(
     email_address: str,
@@ -37,8 +131,8 @@ async def __find_user_credentials(
     """
     credentials = await conn.fetchval(
         'SELECT pgp_sym_decrypt(credentials, $2) FROM gmail_credentials '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $1',
-        email_address, os.getenv('database_encryption_key')
+        'WHERE email_address_hash = $1',
+        hash_email_address(email_address), os.getenv('database_encryption_key')
     )
 
     if credentials:
@@ -64,30 +158,37 @@ async def set_credentials_validity(
     """
     current = await __find_user_credentials(email_address, conn=conn)
     if not current:
+        _credentials_cache.invalidate(email_address)
         return False
 
     await conn.execute(
-        'UPDATE gmail_credentials SET valid = $1 '
-        'WHERE pgp_sym_decrypt(email_address, $3) = $2',
-        valid, email_address, os.getenv('database_encryption_key')
+        'UPDATE gmail_credentials SET valid = $1 WHERE email_address_hash = $2',
+        valid, hash_email_address(email_address)
     )
+    await invalidate_everywhere(_credentials_cache, email_address, conn=conn)
     return True
 
 
-@ensure_connection
-async def refresh_user_credentials(
+async def __refresh_user_credentials(
     email_address: str,
     user_creds: UserCreds,
+    force: bool=False,
+    save: bool=True,
     conn: Connection=None
 ) -> UserCreds:
-    """
-    Refreshes user credentials if they are expired
-    :param email_address: the email address for the google account that the\
-        credentials are tied to
-    :param user_creds: the credentials to refresh if expired
-    :param conn: an open database connection to execute on, if left as `None`,\
-        one will be acquired automatically (must be passed as a keyword argument)
-    """
+    if not force:
+        # another caller may have refreshed the credentials since they were loaded
+        cached_creds = _credentials_cache.get(email_address)
+        if cached_creds is not None:
+            return cached_creds
+
+    previous_access_token = user_creds.get('access_token')
+
+    if force:
+        # aiogoogle only refreshes credentials that have expired
+        user_creds = UserCreds(**user_creds)
+        user_creds['expires_at'] = None
+
     # refresh credentials if they are expired
     try:
         did_refresh, user_creds = await oauth2.refresh(user_creds=user_creds)
@@ -100,15 +201,57 @@ async def refresh_user_credentials(
         # otherwise reraise
         raise
 
-    if did_refresh:
+    if did_refresh and user_creds.get('access_token') != previous_access_token:
         logger.debug('Refreshed Oauth2 user credentials')
 
         # update the credentials in the database to reflect the refreshed credentials
-        await save_user_credentials(email_address, user_creds, conn=conn)
+        if save:
+            await save_user_credentials(email_address, user_creds, conn=conn)
 
+    _credentials_cache.set(email_address, user_creds)
     return user_creds
 
 
+async def refresh_user_credentials(
+    email_address: str,
+    user_creds: UserCreds,
+    force: bool=False,
+    save: bool=True,
+    conn: Connection=None
+) -> UserCreds:
+    """
+    Refreshes user credentials if they are expired. Concurrent calls for the\
+        same email address share a single refresh, which runs on its own\
+        database connection so that it isn't tied to any one caller.
+    Calls made with a connection (passed or from `Database().scope()`) join\
+        a refresh that is already running, otherwise they refresh on that\
+        connection, so that the writes are part of the caller's transaction.
+    :param email_address: the email address for the google account that the\
+        credentials are tied to
+    :param user_creds: the credentials to refresh if expired
+    :param force: whether to refresh the credentials even if they haven't\
+        expired yet (for example shortly before they expire)
+    :param save: whether to save refreshed credentials to the database, pass\
+        `False` when the caller saves them itself
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    if not force and not oauth2.is_expired(user_creds):
+        _credentials_cache.set(email_address, user_creds)
+        return user_creds
+
+    conn = conn or scoped_connection()
+
+    if conn is None or email_address in _refresh_flights:
+        return await _refresh_flights.run(
+            email_address, __refresh_user_credentials,
+            email_address, user_creds, force, save
+        )
+
+    return await __refresh_user_credentials(
+        email_address, user_creds, force, save, conn=conn)
+
+
 @ensure_connection
 async def save_user_credentials(
     email_address: str,
@@ -123,8 +266,7 @@ async def save_user_credentials(
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    # find any existing record that has the same discord id and email address
-    # through interation since the ciphertext is non deterministic
+    # find any existing record that has the same email address
     existing = await __find_user_credentials(email_address, conn=conn)
 
     credentials = json.dumps(user_creds)
@@ -132,85 +274,162 @@ async def save_user_credentials(
     if existing:
         await conn.execute(
             'UPDATE gmail_credentials SET credentials = pgp_sym_encrypt($1, $3) '
-            'WHERE pgp_sym_decrypt(email_address, $3) = $2',
-            credentials, email_address, os.getenv('database_encryption_key'),
+            'WHERE email_address_hash = $2',
+            credentials, hash_email_address(email_address),
+            os.getenv('database_encryption_key'),
+        )
+    else:
+        await conn.execute(
+            'INSERT INTO gmail_credentials (email_address, email_address_hash, credentials) '
+            'VALUES (pgp_sym_encrypt($1, $4), $2, pgp_sym_encrypt($3, $4))',
+            email_address, hash_email_address(email_address), credentials,
+            os.getenv('database_encryption_key')
         )
-        return
 
-    await conn.execute(
-        'INSERT INTO gmail_credentials (email_address, credentials) '
-        'VALUES (pgp_sym_encrypt($1, $3), pgp_sym_encrypt($2, $3))',
-        email_address, credentials, os.getenv('database_encryption_key')
-    )
+    await invalidate_everywhere(_credentials_cache, email_address, conn=conn)
 
 
 @ensure_connection
-async def load_user_credentials(
+async def __load_user_credentials(
     email_address: str,
     conn: Connection=None
 ) -> UserCreds | None:
-    """
-    Loads specified user credentials from the database
-    :param discord_id: the discord id of the account that the credentials\
-        are tied to
-    :param email_address: the email address of the account that the credentials\
-        are tied to
-    :param conn: an open database connection to execute on, if left as `None`,\
-        one will be acquired automatically (must be passed as a keyword argument)
-    """
-    # obtain raw record for respective discord id and email
+    # obtain raw record for respective email
     creds = await __find_user_credentials(email_address, conn=conn)
     if creds is None:
         return None
 
     user_creds = UserCreds(**creds)
-    user_creds = await refresh_user_credentials(
-        email_address, user_creds, conn=conn)
+    user_creds = await refresh_user_credentials(email_address, user_creds, conn=conn)
 
     return user_creds
 
 
-@ensure_connection
-async def load_all_user_credentials(
+async def load_user_credentials(
+    email_address: str,
     conn: Connection=None
-) -> list[UserCreds]:
+) -> UserCreds | None:
     """
-    Returns list of all valid user credentials in the database
+    Loads specified user credentials, from memory if they have been loaded\
+        recently and haven't expired yet, otherwise from the database
+    :param email_address: the email address of the account that the credentials\
+        are tied to
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    all_creds: list[UserCreds] = []
-
-    # select all valid user credentials
-    rows = await conn.fetch(
-        'SELECT pgp_sym_decrypt(email_address, $1) AS email_address, '
-        'pgp_sym_decrypt(credentials, $1) AS credentials '
-        'FROM gmail_credentials WHERE valid = true',
-        os.getenv('database_encryption_key')
+    user_creds = _credentials_cache.get(email_address)
+    if user_creds is not None:
+        return user_creds
+
+    return await __load_user_credentials(email_address, conn=conn)
+
+
+@ensure_connection
+async def __save_refreshed_user_credentials(
+    all_creds: list[MailboxCredentials],
+    conn: Connection=None
+) -> None:
+    # single round trip for a whole chunk of refreshed credentials
+    await conn.executemany(
+        'UPDATE gmail_credentials SET credentials = pgp_sym_encrypt($1, $3) '
+        'WHERE email_address_hash = $2',
+        [
+            (
+                json.dumps(creds.user_creds),
+                hash_email_address(creds.email_address),
+                os.getenv('database_encryption_key')
+            )
+            for creds in all_creds
+        ]
+    )
+    await invalidate_everywhere(
+        _credentials_cache, *(creds.email_address for creds in all_creds), conn=conn)
+
+    for creds in all_creds:
+        _credentials_cache.set(creds.email_address, creds.user_creds)
+
+
+async def __refresh_chunk(
+    chunk: list[MailboxCredentials]
+) -> list[MailboxCredentials]:
+    results = await gather_with_concurrency(
+        config('global.gmail.max_concurrent_token_refreshes'),
+        *(
+            refresh_user_credentials(email_address, user_creds, save=False)
+            for email_address, user_creds in chunk
+        ),
+        return_exceptions=True
     )
 
-    # iterate over all credentials and validate them
-    for row in rows:
-        credentials: str = row['credentials']
-        email_address: str = row['email_address']
+    refreshed_creds: list[MailboxCredentials] = []
+    changed_creds: list[MailboxCredentials] = []
 
-        if credentials is None:
+    for (email_address, user_creds), result in zip(chunk, results):
+        # invalid credentials have already been marked as invalid
+        if isinstance(result, InvalidRefreshTokenError):
             continue
 
-        # load credentials
-        user_creds = UserCreds(**json.loads(credentials))
-
-        # attempt to refresh the credentials, but if they are invalid, set the
-        # credentials validity to false in the database and continue.
-        try:
-            user_creds = await refresh_user_credentials(
-                email_address=email_address, user_creds=user_creds, conn=conn)
-        except InvalidRefreshTokenError:
-            await set_credentials_validity(
-                email_address=email_address, valid=False, conn=conn)
+        if isinstance(result, Exception):
+            logger.warning('Failed to refresh user credentials', exc_info=result)
             continue
 
-        # add valid credentials to current batch
-        all_creds.append(user_creds)
+        refreshed_creds.append(MailboxCredentials(email_address, result))
+
+        if result.get('access_token') != user_creds.get('access_token'):
+            changed_creds.append(MailboxCredentials(email_address, result))
+
+    if changed_creds:
+        await __save_refreshed_user_credentials(changed_creds)
+
+    return refreshed_creds
+
+
+@ensure_connection
+async def __fetch_user_credentials_chunk(
+    after_email_address_hash: bytes | None,
+    chunk_size: int,
+    conn: Connection=None
+) -> list:
+    return await conn.fetch(
+        'SELECT email_address_hash, pgp_sym_decrypt(email_address, $1) AS email_address, '
+        'pgp_sym_decrypt(credentials, $1) AS credentials FROM gmail_credentials '
+        "WHERE valid = true AND email_address_hash > COALESCE($2, ''::BYTEA) "
+        'ORDER BY email_address_hash LIMIT $3',
+        os.getenv('database_encryption_key'), after_email_address_hash, chunk_size
+    )
+
+
+async def load_all_user_credentials(
+    refresh: bool=True,
+    conn: Connection=None
+) -> AsyncIterator[MailboxCredentials]:
+    """
+    Yields all valid user credentials in the database. Rows are read in\
+        chunks ordered by email address hash, each with a query of its own,\
+        so memory use doesn't grow with the amount of stored credentials and\
+        no connection is held while the caller handles the yielded credentials.
+    :param refresh: whether to refresh any expired credentials, credentials\
+        that turn out to be invalid are left out. Each chunk is refreshed\
+        concurrently and the refreshed credentials are saved in one batch.
+    :param conn: an open database connection to read the chunks on, if left\
+        as `None`, one will be acquired for each chunk (must be passed as a\
+        keyword argument)
+    """
+    chunk_size = config('global.gmail.credentials_chunk_size')
+    last_email_address_hash = None
+
+    while rows := await __fetch_user_credentials_chunk(
+            last_email_address_hash, chunk_size, conn=conn):
+        last_email_address_hash = rows[-1]['email_address_hash']
+
+        chunk = [
+            MailboxCredentials(
+                row['email_address'], UserCreds(**json.loads(row['credentials'])))
+            for row in rows if row['credentials'] is not None
+        ]
+
+        if refresh:
+            chunk = await __refresh_chunk(chunk)
 
-    return all_creds
+        for creds in chunk:
+            yield creds
@@ -0,0 +1,125 @@
+"""Process wide cache of the gmail api discovery document"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiogoogle import GoogleAPI
+
+from .sessions import google_client
+from ...common import PROJECT_PATH
+from ...functions import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class _DiscoveryDocumentCache:
+    def __init__(self, api_name: str, api_version: str) -> None:
+        """
+        Caches a google api discovery document in memory with an on-disk
+        snapshot, so that it doesn't have to be downloaded for every request
+        :param api_name: the name of the api to discover, for example `gmail`
+        :param api_version: the version of the api to discover, for example `v1`
+        """
+        self.api_name = api_name
+        self.api_version = api_version
+
+        self.snapshot_path = os.path.join(
+            PROJECT_PATH, '.cache', f'{api_name}_{api_version}_discovery.json')
+
+        self._api: GoogleAPI | None = None
+        self._fetched_at: float = 0
+
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+
+    @property
+    def ttl(self) -> float:
+        """How long the discovery document is considered fresh for (in seconds)"""
+        return config('global.gmail.discovery_document_ttl_hours') * 3600
+
+    @property
+    def expired(self) -> bool:
+        """Whether the cached discovery document is due to be refreshed"""
+        return time.time() - self._fetched_at >= self.ttl
+
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, 'r') as snapshot:
+                discovery_document = json.load(snapshot)
+            fetched_at = os.path.getmtime(self.snapshot_path)
+        except (OSError, json.JSONDecodeError):
+            return False
+
+        self._api = GoogleAPI(discovery_document)
+        self._fetched_at = fetched_at
+        return True
+
+
+    def _save_snapshot(self, discovery_document: dict) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+
+            # write to a temporary file first so that a snapshot is never half written
+            temp_path = f'{self.snapshot_path}.tmp'
+            with open(temp_path, 'w') as snapshot:
+                json.dump(discovery_document, snapshot)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            logger.warning('Failed to save discovery document snapshot', exc_info=True)
+
+
+    async def _fetch(self) -> None:
+        async with google_client() as google:
+            api = await google.discover(self.api_name, self.api_version)
+
+        self._api = api
+        self._fetched_at = time.time()
+        self._save_snapshot(api.discovery_document)
+
+        logger.info(f'Fetched {self.api_name} {self.api_version} discovery document')
+
+
+    async def _refresh(self) -> None:
+        try:
+            async with self._lock:
+                if self.expired:
+                    await self._fetch()
+        except Exception:
+            # keep serving the stale document until the next attempt
+            logger.warning('Failed to refresh discovery document', exc_info=True)
+
+
+    async def get(self) -> GoogleAPI:
+        """
+        Returns the cached api, loading it from the snapshot or downloading
+        it if it hasn't been loaded yet. An expired document is returned as is
+        and refreshed in the background.
+        """
+        if self._api is None:
+            async with self._lock:
+                if self._api is None and not self._load_snapshot():
+                    await self._fetch()
+
+        if self.expired and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+        return self._api
+
+
+_gmail_discovery_cache = _DiscoveryDocumentCache('gmail', 'v1')
+
+
+async def get_gmail_api() -> GoogleAPI:
+    """Returns the gmail api built from the cached discovery document"""
+    return await _gmail_discovery_cache.get()
+
+
+async def preload_gmail_api() -> None:
+    """Loads the gmail discovery document ahead of time (for example on startup)"""
+    await _gmail_discovery_cache.get()
@@ -3,11 +3,11 @@
 from asyncpg import Connection
 
 from ...database import ensure_connection
-from ...filters import EmailNotificationFilters
-from ... import email_addresses
+from ...filters import EmailNotificationFilters, SubscriberFilters
+from ... import email_addresses, filters
 
 
-@ensure_connection
+# the cached functions being wrapped only acquire a connection on a cache miss
 async def get_email_addresses(
     discord_id: int,
     conn: Connection=None
@@ -22,7 +22,6 @@ async def get_email_addresses(
         discord_id, webmail_service='gmail', conn=conn)
 
 
-@ensure_connection
 async def email_address_to_discord_ids(
     email_address: str,
     conn: Connection=None
@@ -37,6 +36,40 @@ async def email_address_to_discord_ids(
         email_address, webmail_service='gmail', conn=conn)
 
 
+@ensure_connection
+async def get_subscriber_filters(
+    email_address: str,
+    conn: Connection=None
+) -> list[SubscriberFilters]:
+    """
+    Returns the filter settings of every user that has an email address\
+        connected, in a single query
+    :param email_address: the email address to get the subscribers of
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    return await filters.get_subscriber_filters(
+        email_address, webmail_service='gmail', conn=conn)
+
+
+@ensure_connection
+async def filter_subscribers(
+    email_address: str,
+    sender: str,
+    conn: Connection=None
+) -> list[int]:
+    """
+    Returns the discord ids of the users that have an email address connected\
+        and whose filters allow emails from a sender
+    :param email_address: the email address that received the email
+    :param sender: the value of the `From` header of the email
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    return await filters.filter_subscribers(
+        email_address, webmail_service='gmail', sender=sender, conn=conn)
+
+
 class GmailEmailAddress:
     def __init__(self, discord_id: int, email_address: str) -> None:
         self.__default = object()
@@ -1,22 +1,32 @@
+import asyncio
 import logging
-import os
-import re
 from base64 import b64decode
+from urllib.parse import urlencode
+from datetime import timedelta
+from typing import Literal, NamedTuple
 
-from aiogoogle import Aiogoogle, GoogleAPI
+from aiogoogle import Aiogoogle, AuthError, GoogleAPI, HTTPError
 from aiogoogle.auth import UserCreds
+from aiogoogle.models import Response
+from aiohttp import ClientError
 from asyncpg import Connection
 
-from .credentials import (
-    load_user_credentials,
-    client_creds
-)
+from .batch import BatchCollector, build_batch_request_part
+from .credentials import load_user_credentials
+from .discovery import get_gmail_api
 from .email_addresses import GmailEmailAddress
-from ...database import Database, ensure_connection
+from .sessions import google_client
+from ...concurrency import gather_with_concurrency
+from ...database import Database, ensure_connection, hash_email_address
+from ...filters import parse_sender_email_address
+from ...functions import config
 
 
 logger = logging.getLogger(__name__)
 
+# emails added with any of these labels are not synced (see `sync_new_emails`)
+IGNORED_LABEL_IDS = {'DRAFT', 'SENT', 'SPAM', 'TRASH'}
+
 
 class EmailPayloadHeader:
     def __init__(self, header_data: dict) -> None:
@@ -64,7 +74,7 @@ class EmailPayloadPart:
     @property
     def body(self) -> EmailPayloadBody:
         if self._body is None:
-            self._body = EmailPayloadBody(self.raw.get('body'))
+            self._body = EmailPayloadBody(self.raw.get('body', {}))
         return self._body
 
 
@@ -99,7 +109,7 @@ class EmailPayload:
     @property
     def body(self) -> EmailPayloadBody:
         if self._body is None:
-            self._body = EmailPayloadBody(self.raw.get('body'))
+            self._body = EmailPayloadBody(self.raw.get('body', {}))
         return self._body
 
 
@@ -125,7 +135,7 @@ class Email:
     @property
     def payload(self) -> EmailPayload:
         if self._payload is None:
-            self._payload = EmailPayload(self.raw.get('payload'))
+            self._payload = EmailPayload(self.raw.get('payload', {}))
         return self._payload
 
     @property
@@ -139,6 +149,92 @@ class Email:
         return self._sender
 
 
+class EmailFetchProfile(NamedTuple):
+    """Which parts of an email to request from the gmail api"""
+    format: Literal['full', 'metadata', 'minimal', 'raw']
+    metadata_headers: list[str] | None = None
+    fields: str | None = None  # partial response field mask
+
+
+# the entire email including the body and every mime part
+FULL_EMAIL_PROFILE = EmailFetchProfile(format='full')
+
+# only what is needed to send a notification for the email
+METADATA_EMAIL_PROFILE = EmailFetchProfile(
+    format='metadata',
+    metadata_headers=['From', 'To', 'Subject'],
+    fields='id,threadId,historyId,labelIds,snippet,sizeEstimate,'
+           'internalDate,payload/headers'
+)
+
+
+# collects email fetches from every inbox into shared batch requests
+_email_batch_collector = BatchCollector(
+    delay=config('global.gmail.email_fetch_batching.delay_ms') / 1000)
+
+
+async def __fetch_email(
+    google: Aiogoogle,
+    gmail: GoogleAPI,
+    email_id: str,
+    profile: EmailFetchProfile
+) -> dict:
+    return await google.as_user(
+        gmail.users.messages.get(
+            userId="me",
+            id=email_id,
+            format=profile.format,
+            metadataHeaders=profile.metadata_headers,
+            fields=profile.fields
+        )
+    )
+
+
+async def __fetch_email_batched(
+    google: Aiogoogle,
+    gmail: GoogleAPI,
+    email_id: str,
+    profile: EmailFetchProfile
+) -> dict:
+    """
+    Same as `__fetch_email`, but the call is sent in a batch request along\
+        with the email fetches of any other inboxes that happen around the same time
+    """
+    params = {
+        'format': profile.format,
+        'metadataHeaders': profile.metadata_headers,
+        'fields': profile.fields
+    }
+    query = urlencode(
+        {key: value for key, value in params.items() if value is not None}, doseq=True)
+
+    part = build_batch_request_part(
+        'GET', f'/gmail/v1/users/me/messages/{email_id}?{query}',
+        google.user_creds['access_token']
+    )
+    try:
+        response = await _email_batch_collector.submit(part)
+    except (ClientError, asyncio.TimeoutError) as exc:
+        # the whole batch failed, retry with a request of its own
+        logger.warning(f'Batched email fetch failed, fetching individually ({exc!r})')
+        return await __fetch_email(google, gmail, email_id, profile)
+
+    if response.ok:
+        return response.json()
+
+    if response.status == 401:
+        raise AuthError(f'Failed to fetch email ({response.status})')
+
+    # no response or a transient error, retry with a request of its own
+    if response.status == 0 or response.transient:
+        return await __fetch_email(google, gmail, email_id, profile)
+
+    raise HTTPError(
+        f'Failed to fetch email ({response.status})',
+        res=Response(status_code=response.status)
+    )
+
+
 async def __retrieve_email_ids(
     count: int | None,
     google: Aiogoogle,
@@ -153,7 +249,7 @@ async def __retrieve_email_ids(
         one will automatically be acquired
     """
     if gmail is None:
-        gmail = await google.discover("gmail", "v1")
+        gmail = await get_gmail_api()
 
     response = await google.as_user(
         gmail.users.messages.list(userId="me", maxResults=count)
@@ -162,10 +258,50 @@ async def __retrieve_email_ids(
     return [message['id'] for message in response['messages']]
 
 
+async def __fetch_emails(
+    google: Aiogoogle,
+    gmail: GoogleAPI,
+    email_ids: list[str],
+    profile: EmailFetchProfile,
+    concurrency: int
+) -> list[Email | HTTPError]:
+    """
+    Fetches emails by their ids, returning either the email or the error\
+        that fetching it failed with, in the same order as the ids
+    """
+    fetch_email = __fetch_email
+    if config('global.gmail.email_fetch_batching.enabled'):
+        fetch_email = __fetch_email_batched
+
+    # fetch actual email data via email ids
+    results = await gather_with_concurrency(
+        concurrency,
+        *(fetch_email(google, gmail, email_id, profile) for email_id in email_ids),
+        return_exceptions=True
+    )
+
+    emails = []
+    for email_id, result in zip(email_ids, results):
+        if isinstance(result, BaseException):
+            # invalid credentials affect every email, so let the caller handle it
+            if isinstance(result, AuthError) or not isinstance(result, HTTPError):
+                raise result
+
+            logger.warning(f'Failed to fetch email with ID: {email_id} ({result})')
+            emails.append(result)
+            continue
+
+        emails.append(Email(result))
+
+    return emails
+
+
 async def __retrieve_emails(
     google: Aiogoogle,
     count: int | None=None,
     email_ids: list[str] = None,
+    concurrency: int=None,
+    profile: EmailFetchProfile=FULL_EMAIL_PROFILE
 ) -> list[Email]:
     """
     Retrieve x amount of emails the Aiogoogle `google` object
@@ -173,36 +309,41 @@ async def __retrieve_emails(
     :param count: the total amount of emails to fetch\
         (if `email_ids` is not provided)
     :param email_ids: a custom list of email ids to fetch the emails of
+    :param profile: which parts of the emails to fetch
+    :param concurrency: the max amount of emails to fetch at the same time,\
+        defaults to the `global.gmail.max_concurrent_email_fetches` config value
     Note that either `count` or `email_ids` should be passed
+
+    Emails are returned in the same order as their ids, emails that fail\
+    to be fetched (for example if they were deleted) are left out
     """
-    gmail = await google.discover("gmail", "v1")  # kms
+    gmail = await get_gmail_api()
+
+    if concurrency is None:
+        concurrency = config('global.gmail.max_concurrent_email_fetches')
 
     # fetch x amount of most recent email ids
     if email_ids is None:
         email_ids = await __retrieve_email_ids(count, google, gmail)
 
-    # fetch actual email data via email ids
-    emails = [
-        Email(await google.as_user(gmail.users.messages.get(userId="me", id=email_id)))
-        for email_id in email_ids
-    ]
-    return emails
+    results = await __fetch_emails(google, gmail, email_ids, profile, concurrency)
+
+    return [result for result in results if isinstance(result, Email)]
 
 
 async def retrieve_emails(
     user_creds: UserCreds,
-    count: int | None=None
+    count: int | None=None,
+    profile: EmailFetchProfile=FULL_EMAIL_PROFILE
 ) -> Email | list[Email]:
     """
     Retrieves a specified amount of emails from a user's inbox
     :param user_creds: the google oauth credentials of the user
     :param count: the total amount of emails to retrieve
+    :param profile: which parts of the emails to fetch
     """
-    async with Aiogoogle(
-        user_creds=user_creds,
-        client_creds=client_creds
-    ) as google:
-        emails = await __retrieve_emails(google, count=count)
+    async with google_client(user_creds) as google:
+        emails = await __retrieve_emails(google, count=count, profile=profile)
 
     # return singular email object if there is only one
     if len(emails) == 1:
@@ -215,20 +356,19 @@ async def retrieve_emails(
 async def get_previous_email_ids(
     email_address: str,
     conn: Connection=None
-) -> list[str] | None:
+) -> list[str]:
     """
-    Gets the ids of the existing emails in the inbox of the
-    specified email address.
-    :param email_address: the email address to get the latest email id of
+    Gets the ids of the emails that have already been seen in the inbox of
+    the specified email address, most recently seen first.
+    :param email_address: the email address to get the seen email ids of
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    previous_email_ids = await conn.fetchval(
-        'SELECT previous_email_ids FROM gmail_credentials '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $1',
-        email_address, os.getenv('database_encryption_key')
+    rows = await conn.fetch(
+        'SELECT email_id FROM gmail_seen_email_ids WHERE email_address_hash = $1 '
+        'ORDER BY seen_at DESC, seen_order DESC', hash_email_address(email_address)
     )
-    return previous_email_ids
+    return [row['email_id'] for row in rows]
 
 
 async def __handle_retrieve_previous_email_ids(
@@ -242,10 +382,7 @@ async def __handle_retrieve_previous_email_ids(
             'Invalid user credentials, either pass `previous_email_ids` '
             'or ensure that there are valid user creds bound to that email address!')
 
-    async with Aiogoogle(
-        user_creds=user_creds,
-        client_creds=client_creds
-    ) as google:
+    async with google_client(user_creds) as google:
         # fetch as many email ids as possible
         previous_email_ids = await __retrieve_email_ids(count=count, google=google)
 
@@ -256,50 +393,52 @@ async def __handle_retrieve_previous_email_ids(
     return previous_email_ids
 
 
-async def __email_address_exists(email_address: str, conn: Connection):
-    return await conn.fetchval(
-        'SELECT email_address FROM gmail_credentials '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $1',
-        email_address, os.getenv('database_encryption_key')
+async def __insert_seen_email_ids(
+    email_address: str,
+    email_ids: list[str],
+    conn: Connection
+) -> int:
+    """
+    Inserts seen email ids (oldest first), returning how many of them weren't\
+        already stored
+    """
+    status = await conn.execute(
+        'INSERT INTO gmail_seen_email_ids (email_address_hash, email_id) '
+        'SELECT $1, unnest($2::TEXT[]) ON CONFLICT DO NOTHING',
+        hash_email_address(email_address), email_ids
     )
+    return int(status.split()[-1])  # "INSERT 0 <count>"
 
 
 @ensure_connection
 async def set_previous_email_ids(
     email_address: str,
-    previous_email_ids: str=None,
+    previous_email_ids: list[str]=None,
     conn: Connection=None
 ) -> None:
     """
-    Sets the `previous_email_ids` database column for an email address.
+    Replaces the seen email ids for an email address.
     If `previous_email_ids` is left as `None`, it will fetch as many of
     the most previous email ids from the user's inbox as possible.
 
-    :param email_address: the email address to set the latest email id for
-    :param previous_email_ids: the previous email ids to set for the user
+    :param email_address: the email address to set the seen email ids for
+    :param previous_email_ids: the previous email ids to set for the user, newest first
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
     """
-    # obtain latest email id from users inbox if it is None
+    # obtain latest email ids from users inbox if they are None
     if previous_email_ids is None:
         previous_email_ids = await __handle_retrieve_previous_email_ids(
             email_address=email_address, count=None, conn=conn)
 
-
-    # should typically always exist if this function is called, but shit happens
-    if not __email_address_exists(email_address, conn):
+    async with conn.transaction():
         await conn.execute(
-            'INSERT INTO gmail_credentials (email_address, previous_email_ids, valid) '
-            'VALUES (pgp_sym_encrypt($1, $3), $2, false)',
-            email_address, previous_email_ids, os.getenv('database_encryption_key')
-        )  # insert new row and set `valid` to false because there are no credentials
-        return
-
-    await conn.execute(
-        'UPDATE gmail_credentials SET previous_email_ids = $1 '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $3',
-        previous_email_ids, os.getenv('database_encryption_key'), email_address
-    )
+            'DELETE FROM gmail_seen_email_ids WHERE email_address_hash = $1',
+            hash_email_address(email_address)
+        )
+        # email ids are listed newest first
+        await __insert_seen_email_ids(
+            email_address, previous_email_ids[::-1], conn)
 
 
 @ensure_connection
@@ -307,35 +446,25 @@ async def add_previous_email_id(
     email_address: str,
     previous_email_id: str=None,
     conn: Connection=None
-) -> None:
+) -> bool:
     """
-    Adds a value to the list of previous email IDs stored in the database for
-    a certain user. If `previous_email_id` is `None`, the id of the latest
-    email in a user's inbox will be used.
+    Marks an email id as seen for a certain user. If `previous_email_id`
+    is `None`, the id of the latest email in a user's inbox will be used.
 
-    :param email_address: the email address to set the latest email id for
-    :param previous_email_id: the email id to add to the existing list of email ids
+    :param email_address: the email address to add the seen email id for
+    :param previous_email_id: the email id to mark as seen
     :param conn: an open database connection to execute on, if left as `None`,\
         one will be acquired automatically (must be passed as a keyword argument)
+
+    :return: whether the email id was newly added (`False` if it was already seen)
     """
     # obtain latest email id from users inbox if it is None
     if previous_email_id is None:
-        previous_email_id = await __handle_retrieve_previous_email_ids(
-            email_address=email_address, count=1, conn=conn)
+        previous_email_id = (await __handle_retrieve_previous_email_ids(
+            email_address=email_address, count=1, conn=conn))[0]
 
-    if not __email_address_exists(email_address, conn):
-        await conn.execute(
-            'INSERT INTO gmail_credentials (email_address, previous_email_ids, valid) '
-            'VALUES (pgp_sym_encrypt($1, $3), $2, false)',
-            email_address, [previous_email_id], os.getenv('database_encryption_key')
-        )  # insert new row and set `valid` to false because there are no credentials
-        return
-
-    await conn.execute(
-        'UPDATE gmail_credentials SET previous_email_ids = previous_email_ids || $1 '
-        'WHERE pgp_sym_decrypt(email_address, $2) = $3',
-        [previous_email_id], os.getenv('database_encryption_key'), email_address
-    )
+    return await __insert_seen_email_ids(
+        email_address, [previous_email_id], conn) > 0
 
 
 @ensure_connection
@@ -344,55 +473,92 @@ async def __check_previous_email_id(
     email_id: str,
     conn: Connection=None
 ) -> bool:
-    previous_email_ids = await get_previous_email_ids(email_address, conn=conn)
+    return await conn.fetchval(
+        'SELECT EXISTS (SELECT 1 FROM gmail_seen_email_ids '
+        'WHERE email_address_hash = $1 AND email_id = $2)',
+        hash_email_address(email_address), email_id
+    )
+
 
-    if email_id in previous_email_ids:
-        return True
-    return False
+@ensure_connection
+async def prune_previous_email_ids(
+    retention: timedelta=None,
+    max_per_email_address: int=None,
+    conn: Connection=None
+) -> None:
+    """
+    Removes seen email ids that are older than the retention window or
+    exceed the cap on stored ids per email address. The most recently seen
+    id of every email address is always kept.
+    :param retention: how long to keep seen email ids for, defaults to the\
+        `global.gmail.seen_email_ids.retention_days` config value
+    :param max_per_email_address: the max amount of ids to keep per email address,\
+        defaults to the `global.gmail.seen_email_ids.max_per_email_address` config value
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    if retention is None:
+        retention = timedelta(days=config('global.gmail.seen_email_ids.retention_days'))
+
+    if max_per_email_address is None:
+        max_per_email_address = config(
+            'global.gmail.seen_email_ids.max_per_email_address')
+
+    status = await conn.execute(
+        'DELETE FROM gmail_seen_email_ids seen USING ('
+            'SELECT email_address_hash, email_id, row_number() OVER ('
+                'PARTITION BY email_address_hash ORDER BY seen_at DESC, seen_order DESC'
+            ') AS position FROM gmail_seen_email_ids'
+        ') ranked WHERE seen.email_address_hash = ranked.email_address_hash '
+        'AND seen.email_id = ranked.email_id AND (ranked.position > $1 '
+        'OR (ranked.position > 1 AND seen.seen_at < CURRENT_TIMESTAMP - $2::INTERVAL))',
+        max_per_email_address, retention
+    )
+    logger.info(f'Pruned seen email ids ({status})')
 
 
-async def retrieve_new_email(email_address: str) -> Email | None:
+async def retrieve_new_email(
+    email_address: str,
+    profile: EmailFetchProfile=METADATA_EMAIL_PROFILE
+) -> Email | None:
     """
     This function is intended to be used to retrieve the email in order to
     send a new email notification to a user.
     Retrieves the most recent email from a user's inbox if it has not already
     been retrieved in the past.
     :param email_address: the email address of the inbox to retrieve the email of
+    :param profile: which parts of the email to fetch
     """
-    pool = await Database().connect()
-
-    async with pool.acquire() as conn:
-        user_creds = await load_user_credentials(email_address, conn=conn)
+    # each database step acquires its own connection, so that none is held
+    # while waiting on gmail
+    user_creds = await load_user_credentials(email_address)
 
-        if user_creds is None:
-            logger.debug('No credentials found or specified email address.')
-            return None
+    if user_creds is None:
+        logger.debug('No credentials found or specified email address.')
+        return None
 
-        async with Aiogoogle(
-            user_creds=user_creds,
-            client_creds=client_creds
-        ) as google:
-            gmail = await google.discover("gmail", "v1")
+    async with google_client(user_creds) as google:
+        gmail = await get_gmail_api()
 
-            email_id = await __retrieve_email_ids(count=1, google=google, gmail=gmail)
-            if not email_id:
-                logger.debug('Failed to obtain a valid email id.')
-                return None
+        email_id = await __retrieve_email_ids(count=1, google=google, gmail=gmail)
+        if not email_id:
+            logger.debug('Failed to obtain a valid email id.')
+            return None
 
-            email_id = email_id[0]  # `__retrieve_email_ids` returns a list of email ids
+        email_id = email_id[0]  # `__retrieve_email_ids` returns a list of email ids
 
-            # whether the fetched email id matches the locally stored "latest email id"
-            email_is_old = await __check_previous_email_id(
-                email_address, email_id, conn=conn)
+        # whether the fetched email id matches the locally stored "latest email id"
+        email_is_old = await __check_previous_email_id(email_address, email_id)
 
-            if email_is_old:  # email has already been retrieved
-                logger.debug('Email has already been retrieved.')
-                return None
+        if email_is_old:  # email has already been retrieved
+            logger.debug('Email has already been retrieved.')
+            return None
 
-            # fetch actual email
-            email = await __retrieve_emails(google, email_ids=[email_id])
+        # fetch actual email
+        email = await __retrieve_emails(
+            google, email_ids=[email_id], profile=profile)
 
-            await add_previous_email_id(email_address, email_id, conn=conn)
+        await add_previous_email_id(email_address, email_id)
 
     if email:
         email = email[0]  # email is a 1 item list of emails
@@ -405,6 +571,243 @@ async def retrieve_new_email(email_address: str) -> Email | None:
     return None
 
 
+@ensure_connection
+async def get_history_id(
+    email_address: str,
+    conn: Connection=None
+) -> int | None:
+    """
+    Gets the gmail history id up to which the inbox of the specified
+    email address has been synced
+    :param email_address: the email address to get the history id of
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    return await conn.fetchval(
+        'SELECT history_id FROM gmail_credentials WHERE email_address_hash = $1',
+        hash_email_address(email_address)
+    )
+
+
+async def __retrieve_current_history_id(
+    google: Aiogoogle,
+    gmail: GoogleAPI
+) -> int:
+    profile = await google.as_user(gmail.users.getProfile(userId="me"))
+    return int(profile['historyId'])
+
+
+async def set_history_id(
+    email_address: str,
+    history_id: int | str=None,
+    conn: Connection=None
+) -> None:
+    """
+    Sets the gmail history id up to which the inbox of the specified email
+    address has been synced. The stored history id is never moved backwards.
+    If `history_id` is left as `None`, the current history id of the user's
+    inbox will be fetched and used, so only emails received from now on are synced.
+
+    :param email_address: the email address to set the history id for
+    :param history_id: the history id to set
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    if history_id is None:
+        user_creds = await load_user_credentials(email_address, conn=conn)
+        if user_creds is None:
+            raise NotImplementedError(
+                'Invalid user credentials, either pass `history_id` or ensure '
+                'that there are valid user creds bound to that email address!')
+
+        async with google_client(user_creds) as google:
+            gmail = await get_gmail_api()
+            history_id = await __retrieve_current_history_id(google, gmail)
+
+    await __update_history_id(email_address, history_id, conn=conn)
+
+
+# kept apart from `set_history_id` so that no connection is held while the
+# current history id is fetched from gmail
+@ensure_connection
+async def __update_history_id(
+    email_address: str,
+    history_id: int | str,
+    conn: Connection=None
+) -> None:
+    await conn.execute(
+        'UPDATE gmail_credentials SET history_id = GREATEST(history_id, $1) '
+        'WHERE email_address_hash = $2',
+        int(history_id), hash_email_address(email_address)
+    )
+
+
+async def __retrieve_added_email_ids(
+    google: Aiogoogle,
+    gmail: GoogleAPI,
+    start_history_id: int
+) -> tuple[list[str], int]:
+    """
+    Returns the ids of the emails added to a user's inbox after the given
+    history id (oldest first) along with the latest history id of the inbox
+    """
+    email_ids: list[str] = []
+    page_token = None
+
+    while True:
+        response = await google.as_user(
+            gmail.users.history.list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes="messageAdded",
+                pageToken=page_token
+            )
+        )
+
+        for history in response.get('history', []):
+            for message_added in history.get('messagesAdded', []):
+                message: dict = message_added['message']
+
+                # ignore drafts, outgoing emails and the like
+                if IGNORED_LABEL_IDS & set(message.get('labelIds', [])):
+                    continue
+
+                if message['id'] not in email_ids:
+                    email_ids.append(message['id'])
+
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            return email_ids, int(response['historyId'])
+
+
+def _is_not_found(result: Email | HTTPError) -> bool:
+    return isinstance(result, HTTPError) and result.res is not None \
+        and result.res.status_code == 404
+
+
+@ensure_connection
+async def __get_unseen_email_ids(
+    email_address: str,
+    email_ids: list[str],
+    conn: Connection=None
+) -> list[str]:
+    """Returns the email ids that haven't been seen yet, in the same order"""
+    seen = await conn.fetch(
+        'SELECT email_id FROM gmail_seen_email_ids '
+        'WHERE email_address_hash = $1 AND email_id = ANY($2::TEXT[])',
+        hash_email_address(email_address), email_ids
+    )
+    seen = {row['email_id'] for row in seen}
+
+    return [email_id for email_id in email_ids if email_id not in seen]
+
+
+async def __claim_unseen_email_ids(
+    email_address: str,
+    email_ids: list[str],
+    conn: Connection
+) -> list[str]:
+    """Marks email ids as seen and returns the ones that weren't already seen"""
+    rows = await conn.fetch(
+        'INSERT INTO gmail_seen_email_ids (email_address_hash, email_id) '
+        'SELECT $1, unnest($2::TEXT[]) ON CONFLICT DO NOTHING RETURNING email_id',
+        hash_email_address(email_address), email_ids
+    )
+    claimed = {row['email_id'] for row in rows}
+
+    return [email_id for email_id in email_ids if email_id in claimed]
+
+
+async def sync_new_emails(
+    email_address: str,
+    history_id: int | str=None,
+    profile: EmailFetchProfile=METADATA_EMAIL_PROFILE
+) -> list[Email]:
+    """
+    This function is intended to be used to retrieve the emails in order to
+    send new email notifications to a user.
+    Retrieves every email that has been added to a user's inbox since the
+    last sync (using the gmail history api), oldest first.
+    :param email_address: the email address of the inbox to sync
+    :param history_id: the history id sent along with the push notification,\
+        if the inbox has already been synced up to it, nothing will be fetched
+    :param profile: which parts of the emails to fetch
+    """
+    # many inboxes can sync at once, so a connection is only acquired for each
+    # database step rather than held while waiting on gmail
+    start_history_id = await get_history_id(email_address)
+
+    # the inbox was connected before history ids were being stored
+    if start_history_id is None:
+        email = await retrieve_new_email(email_address, profile=profile)
+        await set_history_id(email_address, history_id)
+
+        return [email] if email else []
+
+    if history_id is not None and start_history_id >= int(history_id):
+        logger.debug('Inbox has already been synced past the history id.')
+        return []
+
+    user_creds = await load_user_credentials(email_address)
+
+    if user_creds is None:
+        logger.debug('No credentials found or specified email address.')
+        return []
+
+    async with google_client(user_creds) as google:
+        gmail = await get_gmail_api()
+
+        try:
+            email_ids, latest_history_id = await __retrieve_added_email_ids(
+                google, gmail, start_history_id)
+        except HTTPError as exc:
+            if exc.res is None or exc.res.status_code != 404:
+                raise
+
+            # gmail only keeps history for a limited amount of time,
+            # so start syncing again from the current history id
+            logger.info('Stored history id is too old, resetting it.')
+            await set_history_id(
+                email_address, await __retrieve_current_history_id(google, gmail))
+            return []
+
+        email_ids = await __get_unseen_email_ids(email_address, email_ids)
+
+        results = []
+        if email_ids:
+            results = await __fetch_emails(
+                google, gmail, email_ids, profile,
+                config('global.gmail.max_concurrent_email_fetches')
+            )
+
+    # emails are only marked as seen once they have been fetched, and
+    # deleted emails are skipped, the rest are retried on the next sync
+    fetched_ids = [
+        email_id for email_id, result in zip(email_ids, results)
+        if isinstance(result, Email) or _is_not_found(result)
+    ]
+    retry = len(fetched_ids) < len(email_ids)
+
+    pool = await Database().connect()
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            claimed = set(
+                await __claim_unseen_email_ids(email_address, fetched_ids, conn))
+
+            # the history is listed from the same point again until every email is fetched
+            if retry:
+                logger.info('Failed to fetch some emails, retrying on the next sync.')
+            else:
+                await set_history_id(email_address, latest_history_id, conn=conn)
+
+    # emails claimed by a concurrent sync are notified by it
+    return [
+        result for result in results
+        if isinstance(result, Email) and result.id in claimed
+    ]
+
+
 async def check_filters(
     discord_id: str,
     email_address: str,
@@ -420,18 +823,16 @@ async def check_filters(
     gmail_address = GmailEmailAddress(discord_id, email_address)
 
     # extract email address portion of email sender
-    # for example, extract `sender@example.com` from `Sender <sender@example.com>`
-    match = re.search(r'<(.*)>', email.sender)
-    sender = match.group(1) if match else email.sender
+    sender = parse_sender_email_address(email.sender)
 
     # sender whitelist is enabled
     if await gmail_address.filters.sender_whitelist_enabled is True:
         # sender is not whitelisted
-        if sender.lower() not in await gmail_address.filters.whitelisted_senders:
+        if sender not in await gmail_address.filters.whitelisted_senders:
             return False
 
     # sender is blacklist
-    if sender.lower() in await gmail_address.filters.blacklisted_senders:
+    if sender in await gmail_address.filters.blacklisted_senders:
         return False
 
     # all checks passed
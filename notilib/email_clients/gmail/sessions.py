@@ -0,0 +1,99 @@
+"""Shared http connection pool for requests to google apis"""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+from aiogoogle import Aiogoogle
+from aiogoogle.auth.creds import UserCreds
+from aiogoogle.sessions.aiohttp_session import AiohttpSession
+from aiohttp import TCPConnector
+
+from .credentials import client_creds, oauth2
+
+
+logger = logging.getLogger(__name__)
+
+
+class GoogleHttpClient:
+    """Google http client class that holds a single pooled session which
+    is shared throughout the program by reusing the same instance of the
+    class, so that connections to google are kept alive between requests."""
+    # global class instance
+    _instance = None
+
+    # define values within so that they can be overridden
+    connection_limit = 100
+    connection_limit_per_host = 30
+    dns_cache_ttl = 300  # seconds
+    keepalive_timeout = 60  # seconds
+
+    # make sure only one instance exists (singleton)
+    def __new__(cls) -> Any:
+        if cls._instance is None:
+            cls._instance = super(GoogleHttpClient, cls).__new__(cls)
+        return cls._instance
+
+
+    # global session
+    session: AiohttpSession = None
+
+
+    def _create_session(self) -> AiohttpSession:
+        connector = TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self.session = AiohttpSession(connector=connector)
+
+        # also send oauth2 token requests over the shared session
+        oauth2.active_session = self.session
+
+        logger.info('Created new google http session.')
+        return self.session
+
+
+    def session_factory(self) -> AiohttpSession:
+        """Returns the shared session, creating it if it doesn't exist\
+            (can be used as an Aiogoogle `session_factory`)"""
+        if self.session is None or self.session.closed:
+            self._create_session()
+        return self.session
+
+
+    async def start(self) -> AiohttpSession:
+        """Creates the shared session if it doesn't exist (call on startup)"""
+        return self.session_factory()
+
+
+    async def close(self) -> None:
+        """Closes the shared session (call on shutdown)"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info('Closed the google http session.')
+
+        oauth2.active_session = None
+        self.session = None
+
+
+@asynccontextmanager
+async def google_client(user_creds: UserCreds=None) -> AsyncIterator[Aiogoogle]:
+    """
+    Yields an `Aiogoogle` client that sends its requests over the shared\
+        session, the user's credentials are applied to each request.
+    Unlike `async with Aiogoogle(...)`, the session is left open on exit.
+    :param user_creds: the google oauth credentials of the user
+    """
+    google = Aiogoogle(
+        user_creds=user_creds,
+        client_creds=client_creds,
+        session_factory=GoogleHttpClient().session_factory
+    )
+
+    # token refreshes (for credentials without an expiry) would otherwise be
+    # sent in `async with session_factory()`, closing the shared session
+    google.oauth2.active_session = GoogleHttpClient().session_factory()
+
+    yield google
@@ -1,12 +1,12 @@
 import logging
 import warnings
 
-from aiohttp import ClientSession
 from aiogoogle import HTTPError
 from aiogoogle.auth.creds import UserCreds
 from aiogoogle.utils import _dict
 
 from .credentials import oauth2
+from .sessions import GoogleHttpClient
 from ...exceptions import InvalidRefreshTokenError
 
 
@@ -50,14 +50,14 @@ async def get_user_info(user_creds: UserCreds) -> dict | UserInfo:
     if refreshed:
         logger.info('User credentials were refreshed!')
 
-    async with ClientSession() as session:
-        headers = {'Authorization': f'Bearer {user_creds.access_token}'}
-
-        # send get request to userinfo endpoint with the user's access token as
-        # the Authorization header
-        res = await session.get(
-            'https://www.googleapis.com/oauth2/v2/userinfo', headers=headers)
+    session = GoogleHttpClient().session_factory()
+    headers = {'Authorization': f'Bearer {user_creds.access_token}'}
 
+    # send get request to userinfo endpoint with the user's access token as
+    # the Authorization header
+    async with session.get(
+        'https://www.googleapis.com/oauth2/v2/userinfo', headers=headers
+    ) as res:
         user_info: dict = await res.json()
 
     # return the user info as a custom dict type
@@ -1,74 +1,166 @@
+import asyncio
 import json
+import logging
 import os
-from textwrap import dedent
-from uuid import uuid4
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from typing import NamedTuple
 
-from aiogoogle import Aiogoogle
+import aiohttp
 from aiogoogle.auth import UserCreds
-from aiohttp import ClientSession
+from asyncpg import Connection
 
-from .credentials import (
-    client_creds
+from .batch import (
+    MAX_CALLS_PER_BATCH,
+    TRANSIENT_STATUSES,
+    BatchRequestPart,
+    build_batch_request_part,
+    send_batch_request
 )
+from .credentials import MailboxCredentials, refresh_user_credentials
+from .discovery import get_gmail_api
+from .sessions import google_client
+from ...concurrency import RateLimiter, gather_with_concurrency
+from ...database import ensure_connection, hash_email_address
+from ...exceptions import InvalidRefreshTokenError
+from ...functions import config
 
 
-async def watch_user_inbox(user_creds: UserCreds) -> None:
+logger = logging.getLogger(__name__)
+
+
+def _parse_watch_expiration(watch_response: dict) -> datetime:
+    # gmail returns the expiration as a unix timestamp in milliseconds
+    return datetime.fromtimestamp(
+        int(watch_response['expiration']) / 1000, tz=timezone.utc)
+
+
+async def watch_user_inbox(user_creds: UserCreds) -> datetime:
     """
     Watches a user's inbox, so that the topic is notified whenever
     a new email is received.
     :param user_creds: the user's google oauth2 credentials
+
+    :return: when the watch expires (it has to be renewed before then)
     """
-    async with Aiogoogle(
-        user_creds=user_creds,
-        client_creds=client_creds
-    ) as google:
-        gmail = await google.discover("gmail", "v1")
+    async with google_client(user_creds) as google:
+        gmail = await get_gmail_api()
 
-        await google.as_user(
+        watch_response = await google.as_user(
             gmail.users.watch(
                 userId="me",
                 topicName=os.getenv('gcloud_topic_name')
             )
         )
 
+    return _parse_watch_expiration(watch_response)
+
 
-def build_batch_request_body(
-    requests_data: list[dict],
-    boundary: str
-) -> str:
+@ensure_connection
+async def set_watch_expiration(
+    email_address: str,
+    expiration: datetime,
+    conn: Connection=None
+) -> None:
     """
-    Builds the request body for a batch request
-    :param request_data: the request data to build from
-    :param boundary: the boundary name for the batches
+    Sets when the inbox watch of the specified email address expires
+    :param email_address: the email address of the watched inbox
+    :param expiration: when the watch expires
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
     """
-    # https://developers.google.com/gmail/api/guides/batch
-    body = ''
-    for req in requests_data:
-        # add each batched request
-        body += dedent(f"""
-            --{boundary}
-            Content-Type: application/http
-            Content-ID: {req["headers"]["Content-ID"]}
+    await conn.execute(
+        'UPDATE gmail_credentials SET watch_expiration = $1 WHERE email_address_hash = $2',
+        expiration, hash_email_address(email_address)
+    )
 
-            {req["method"]} {req["url"]}
-            Content-Length: {len(req["data"])}
-            Authorization: {req["headers"]["Authorization"]}
 
+@ensure_connection
+async def get_inboxes_due_for_rewatch(
+    window: timedelta,
+    limit: int,
+    conn: Connection=None
+) -> list[MailboxCredentials]:
+    """
+    Returns the credentials of the inboxes whose watch expires within\
+        `window` (or has never been stored), soonest to expire first
+    :param window: how long before their watch expires inboxes are due
+    :param limit: the max amount of inboxes to return
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    rows = await conn.fetch(
+        'SELECT pgp_sym_decrypt(email_address, $1) AS email_address, '
+        'pgp_sym_decrypt(credentials, $1) AS credentials FROM gmail_credentials '
+        'WHERE valid = true AND (watch_expiration IS NULL OR watch_expiration < now() + $2) '
+        'ORDER BY watch_expiration NULLS FIRST LIMIT $3',
+        os.getenv('database_encryption_key'), window, limit
+    )
 
-            {req["data"]}
-        """)  # remove any leading whitespace caused by indentation
+    return [
+        MailboxCredentials(row['email_address'], UserCreds(**json.loads(row['credentials'])))
+        for row in rows if row['credentials'] is not None
+    ]
 
-    # boundary closing
-    body += f'--{boundary}--'
-    return body
+
+async def __refresh_for_rewatch(
+    creds: MailboxCredentials,
+    force: bool=False
+) -> MailboxCredentials | None:
+    try:
+        user_creds = await refresh_user_credentials(
+            creds.email_address, creds.user_creds, force=force)
+    except InvalidRefreshTokenError:
+        return None  # the credentials have been marked as invalid
+
+    return MailboxCredentials(creds.email_address, user_creds)
+
+
+async def rewatch_due_inboxes(window: timedelta, limit: int) -> int:
+    """
+    Renews the watch of up to `limit` inboxes whose watch expires within\
+        `window`, using batch requests
+    :param window: how long before their watch expires inboxes are renewed
+    :param limit: the max amount of inboxes to renew
+
+    :return: the amount of inboxes that were renewed
+    """
+    due = await get_inboxes_due_for_rewatch(window, limit)
+
+    refreshed = await gather_with_concurrency(
+        config('global.gmail.max_concurrent_token_refreshes'),
+        *(__refresh_for_rewatch(creds) for creds in due),
+        return_exceptions=True
+    )
+
+    all_creds: list[MailboxCredentials] = []
+    for result in refreshed:
+        if isinstance(result, Exception):
+            logger.warning('Failed to refresh user credentials', exc_info=result)
+        elif result is not None:
+            all_creds.append(result)
+
+    results = await batch_watch_requests(all_creds)
+    return sum(result.ok for result in results)
+
+
+@ensure_connection
+async def count_watched_inboxes(conn: Connection=None) -> int:
+    """
+    Returns the amount of inboxes with valid credentials
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    return await conn.fetchval('SELECT COUNT(*) FROM gmail_credentials WHERE valid = true')
 
 
 def build_watch_batch_data(
     user_creds: UserCreds,
     label_ids: list[str] = ['INBOX']
-) -> dict:
+) -> BatchRequestPart:
     """
-    Returns the data necessary for building a batch request body
+    Returns the watch call of a user to include in a batch request
     :param user_creds: the google oauth2 credentials of the user
     :param label_ids: the labels to watch (INBOX, SPAM, ETC)
     """
@@ -78,52 +170,176 @@ def build_watch_batch_data(
         "topicName": os.getenv('gcloud_topic_name')
     }
 
-    # entire request
-    request_data = {
-        'method': 'POST',
-        'url': 'https://gmail.googleapis.com/gmail/v1/users/me/watch',
-        'headers': {
-            'Content-ID': str(uuid4()),
-            'Authorization': f'Bearer {user_creds.access_token}'
-            },
-        'data': json.dumps(data)
-        }
-    return request_data
+    return build_batch_request_part(
+        'POST', '/gmail/v1/users/me/watch', user_creds.access_token, data)
+
+
+class WatchResult(NamedTuple):
+    """The outcome of watching an inbox as part of a batch request"""
+    email_address: str
+    status: int  # `0` if no response was received for the call
+    expiration: datetime | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.expiration is not None
+
+
+async def __send_watch_batch(
+    all_creds: list[MailboxCredentials],
+    rate_limiter: RateLimiter
+) -> list[WatchResult]:
+    # Build the batched calls from credentials
+    parts = [build_watch_batch_data(creds.user_creds) for creds in all_creds]
+
+    await rate_limiter.wait(cost=len(parts))
+
+    try:
+        responses = await send_batch_request(parts, boundary='batch_watch_inbox')
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        logger.warning('Batch watch request failed', exc_info=True)
+        responses = {}
 
+    results: dict[str, WatchResult] = {}
 
-async def batch_watch_requests(user_creds_list: list[UserCreds]) -> None:
+    for part, creds in zip(parts, all_creds):
+        response = responses.get(part.content_id)
+        if response is None:
+            continue
+
+        if response.ok:
+            expiration = _parse_watch_expiration(response.json())
+            results[creds.email_address] = WatchResult(
+                creds.email_address, response.status, expiration)
+        else:
+            results[creds.email_address] = WatchResult(
+                creds.email_address, response.status,
+                error=response.body.decode(errors='replace'))
+
+    # calls without a response are treated as transient failures
+    return [
+        results.get(creds.email_address, WatchResult(creds.email_address, 0))
+        for creds in all_creds
+    ]
+
+
+@ensure_connection
+async def __save_watch_expirations(
+    results: list[WatchResult],
+    conn: Connection=None
+) -> None:
+    await conn.executemany(
+        'UPDATE gmail_credentials SET watch_expiration = $1 WHERE email_address_hash = $2',
+        [
+            (result.expiration, hash_email_address(result.email_address))
+            for result in results
+        ]
+    )
+
+
+async def __reauthorize(
+    all_creds: list[MailboxCredentials],
+    results: list[WatchResult]
+) -> list[MailboxCredentials]:
     """
-    Batches inbox watch requests to the gmail api for a list of given users
-    :param user_creds_list: a list of respective google oauth2 user credentials to\
-        watch the user inboxs with
+    Force refreshes rejected credentials, returning the refreshed ones. The\
+        inboxes whose credentials couldn't be refreshed are added to `results`.
     """
-    boundary = 'batch_watch_inbox'
+    refreshed = await gather_with_concurrency(
+        config('global.gmail.max_concurrent_token_refreshes'),
+        *(__refresh_for_rewatch(creds, force=True) for creds in all_creds),
+        return_exceptions=True
+    )
 
-    # Headers for the batch request
-    headers = {
-        'Content-Type': f'multipart/mixed; boundary={boundary}',
-    }
+    reauthorized: list[MailboxCredentials] = []
+
+    for creds, result in zip(all_creds, refreshed):
+        if isinstance(result, MailboxCredentials):
+            reauthorized.append(result)
+            continue
+
+        if isinstance(result, Exception):
+            logger.warning('Failed to refresh user credentials', exc_info=result)
+            error = repr(result)
+        else:
+            error = 'Invalid refresh token'  # has been marked as invalid
+
+        results.append(WatchResult(creds.email_address, 401, error=error))
+
+    return reauthorized
+
+
+async def batch_watch_requests(
+    all_creds: list[MailboxCredentials],
+    max_retries: int=3
+) -> list[WatchResult]:
+    """
+    Batches inbox watch requests to the gmail api for a list of given users.
+    Batches are sent concurrently, calls that fail transiently are retried\
+        with backoff, and the new watch expirations are saved. Calls whose\
+        access token gmail rejects are retried once with refreshed credentials\
+        (credentials that can't be refreshed are marked as invalid).
+    :param all_creds: the credentials of the inboxes to watch
+    :param max_retries: how many times to retry calls that fail transiently
+
+    :return: the outcome of watching each inbox
+    """
+    rate_limiter = RateLimiter(config('global.gmail.rewatch.max_per_second'))
+
+    pending = list(all_creds)
+    results: list[WatchResult] = []
 
-    # limit it to 100 api calls per batch request
-    max_calls_per_batch = 100
+    # inboxes whose credentials have been refreshed after being rejected
+    reauthorized: set[str] = set()
 
-    for i in range(0, len(user_creds_list), max_calls_per_batch):
-        # create sublist of next 100 elements
-        user_creds_sublist = user_creds_list[i:i+max_calls_per_batch]
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(2 ** (attempt - 1) * (1 + random.random()))
 
-        # Build the request data dictionary from credentials
-        requests_data = [
-            build_watch_batch_data(user_creds)
-            for user_creds in user_creds_sublist
+        batches = [
+            pending[i:i+MAX_CALLS_PER_BATCH]
+            for i in range(0, len(pending), MAX_CALLS_PER_BATCH)
         ]
+        batch_results = await gather_with_concurrency(
+            config('global.gmail.rewatch.max_concurrent_batches'),
+            *(__send_watch_batch(batch, rate_limiter) for batch in batches)
+        )
 
-        # build the request body string with all the requests for the batch
-        body = build_batch_request_body(requests_data, boundary)
+        creds_by_email_address = {creds.email_address: creds for creds in pending}
+        pending = []
+        unauthorized: list[MailboxCredentials] = []
 
-        async with ClientSession() as session:
-            await session.post(
-                url='https://www.googleapis.com/batch/gmail/v1',
-                headers=headers,
-                data=body,
-                timeout=15
-            )
+        for result in chain.from_iterable(batch_results):
+            creds = creds_by_email_address[result.email_address]
+
+            # the access token may have expired since it was refreshed (for
+            # example while waiting to retry), so refresh it and retry once
+            if result.status == 401 and result.email_address not in reauthorized \
+                    and attempt < max_retries:
+                unauthorized.append(creds)
+                continue
+
+            retry = result.status == 0 or result.status in TRANSIENT_STATUSES
+
+            if retry and attempt < max_retries:
+                pending.append(creds)
+            else:
+                results.append(result)
+
+        if unauthorized:
+            pending.extend(await __reauthorize(unauthorized, results))
+            reauthorized.update(creds.email_address for creds in unauthorized)
+
+        if not pending:
+            break
+
+    succeeded = [result for result in results if result.ok]
+    if succeeded:
+        await __save_watch_expirations(succeeded)
+
+    for result in results:
+        if not result.ok:
+            logger.warning(f'Failed to watch inbox ({result.status}): {result.error}')
+
+    return results
@@ -0,0 +1,166 @@
+"""Durable queue of events sent from the website to the bot"""
+
+import json
+import os
+from datetime import timedelta
+from typing import NamedTuple
+
+from asyncpg import Connection
+
+from .database import ensure_connection
+
+
+# channel that is notified whenever an event is enqueued
+EVENT_QUEUE_CHANNEL = 'event_queue'
+
+
+class QueuedEvent(NamedTuple):
+    """An event that has been claimed from the queue"""
+    event_id: int
+    event_name: str
+    kwargs: dict
+    attempts: int
+    max_attempts: int
+
+
+@ensure_connection
+async def enqueue_event(
+    event_name: str,
+    kwargs: dict,
+    max_attempts: int=5,
+    conn: Connection=None
+) -> int:
+    """
+    Adds an event to the queue and wakes up any listening consumers
+    :param event_name: the name of the event to dispatch, for example\
+        `gmail_email_receive`
+    :param kwargs: the json serializable keyword arguments of the event
+    :param max_attempts: how many times handling the event is attempted\
+        before it is dead lettered
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+
+    :return: the id of the queued event
+    """
+    # the notification is only sent once the insert is committed
+    return await conn.fetchval(
+        'WITH event AS ('
+        '  INSERT INTO event_queue (event_name, payload, max_attempts) '
+        '  VALUES ($1, pgp_sym_encrypt($2, $3), $4) RETURNING event_id'
+        ') SELECT event_id FROM event, pg_notify($5, event_id::TEXT)',
+        event_name, json.dumps(kwargs), os.getenv('database_encryption_key'),
+        max_attempts, EVENT_QUEUE_CHANNEL
+    )
+
+
+async def __dead_letter_exhausted_events(conn: Connection) -> None:
+    # events whose last attempt timed out (for example because the consumer crashed)
+    await conn.execute(
+        'WITH exhausted AS ('
+        '  DELETE FROM event_queue WHERE event_id IN ('
+        '    SELECT event_id FROM event_queue '
+        '    WHERE attempts >= max_attempts AND visible_at <= now() '
+        '    FOR UPDATE SKIP LOCKED'
+        '  ) RETURNING *'
+        ') INSERT INTO event_queue_dead_letters '
+        '(event_id, event_name, payload, attempts, created_at, last_error) '
+        "SELECT event_id, event_name, payload, attempts, created_at, "
+        "COALESCE(last_error, 'Timed out') FROM exhausted"
+    )
+
+
+@ensure_connection
+async def dequeue_events(
+    limit: int,
+    visibility_timeout: timedelta,
+    event_ids: list[int] | None=None,
+    conn: Connection=None
+) -> list[QueuedEvent]:
+    """
+    Claims up to `limit` events that are ready to be handled, oldest first.
+    Claimed events are hidden from other consumers until `visibility_timeout`\
+        has passed, if they haven't been completed by then they are handed\
+        out again. Events that are claimed by other consumers are skipped,\
+        so any amount of consumers can drain the queue in parallel.
+    :param limit: the max amount of events to claim
+    :param visibility_timeout: how long claimed events are hidden for
+    :param event_ids: only claim the events with these ids, if left as `None`,\
+        any event can be claimed
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    async with conn.transaction():
+        await __dead_letter_exhausted_events(conn)
+
+        rows = await conn.fetch(
+            'UPDATE event_queue SET attempts = attempts + 1, visible_at = now() + $2 '
+            'WHERE event_id IN ('
+            '  SELECT event_id FROM event_queue WHERE visible_at <= now() '
+            '  AND attempts < max_attempts AND ($4::BIGINT[] IS NULL OR event_id = ANY($4)) '
+            '  ORDER BY event_id LIMIT $1 FOR UPDATE SKIP LOCKED'
+            ') RETURNING event_id, event_name, pgp_sym_decrypt(payload, $3) AS payload, '
+            'attempts, max_attempts',
+            limit, visibility_timeout, os.getenv('database_encryption_key'), event_ids
+        )
+
+    return sorted(
+        (
+            QueuedEvent(
+                row['event_id'], row['event_name'], json.loads(row['payload']),
+                row['attempts'], row['max_attempts']
+            )
+            for row in rows
+        ),
+        key=lambda event: event.event_id
+    )
+
+
+@ensure_connection
+async def complete_events(
+    event_ids: list[int],
+    conn: Connection=None
+) -> None:
+    """
+    Removes events that have been handled from the queue
+    :param event_ids: the ids of the handled events
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    await conn.execute('DELETE FROM event_queue WHERE event_id = ANY($1)', event_ids)
+
+
+@ensure_connection
+async def fail_event(
+    event: QueuedEvent,
+    error: str,
+    retry_delay: timedelta,
+    conn: Connection=None
+) -> bool:
+    """
+    Records a failed attempt at handling an event, the event is retried after\
+        `retry_delay` unless it has run out of attempts, then it is dead lettered
+    :param event: the event that failed to be handled
+    :param error: a description of why handling the event failed
+    :param retry_delay: how long to wait before retrying the event
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+
+    :return: whether the event will be retried
+    """
+    if event.attempts < event.max_attempts:
+        await conn.execute(
+            'UPDATE event_queue SET visible_at = now() + $2, last_error = $3 '
+            'WHERE event_id = $1',
+            event.event_id, retry_delay, error
+        )
+        return True
+
+    await conn.execute(
+        'WITH failed AS ('
+        '  DELETE FROM event_queue WHERE event_id = $1 RETURNING *'
+        ') INSERT INTO event_queue_dead_letters '
+        '(event_id, event_name, payload, attempts, created_at, last_error) '
+        'SELECT event_id, event_name, payload, attempts, created_at, $2 FROM failed',
+        event.event_id, error
+    )
+    return False
@@ -4,3 +4,7 @@ class ConfirmationError(Exception):
 
 class InvalidRefreshTokenError(Exception):
     """Exception for an invalid user reset token"""
+
+
+class InvalidFrameError(Exception):
+    """Exception for a malformed or oversized socket message frame"""
@@ -1,10 +1,21 @@
+import json
 import os
-from typing import Literal
+import re
+from typing import AsyncIterator, Literal, NamedTuple
 
 from asyncpg import Connection
 
+from .cache import AsyncCache, cached, invalidate_everywhere
 from .common import WebmailServiceLiteral
-from .database import ensure_connection
+from .database import ensure_connection, hash_email_address
+from .functions import config
+
+
+# channel that is notified whenever a row of `email_notification_filters` changes
+SUBSCRIBER_FILTERS_CHANNEL = 'email_notification_filters'
+
+# filter settings by (discord id, email address hash, webmail service)
+subscriber_filters_cache = AsyncCache('subscriber_filters')
 
 
 class EmailNotificationFilters:
@@ -31,21 +42,24 @@ class EmailNotificationFilters:
         self._blacklisted_senders: list[str] = self.__default
 
 
-    @ensure_connection
+    async def _invalidate_cache(self, conn: Connection) -> None:
+        await invalidate_everywhere(
+            subscriber_filters_cache,
+            (self.discord_id, hash_email_address(self.email_address), self.webmail_service),
+            conn=conn
+        )
+
+
     async def __load_filter_data(self, conn: Connection=None) -> None:
-        data = await conn.fetchrow(
-            'SELECT sender_whitelist_enabled, decrypt_array(whitelisted_senders, $4) '
-            'AS whitelisted_senders, decrypt_array(blacklisted_senders, $4) '
-            'AS blacklisted_senders FROM email_notification_filters WHERE discord_id = $1 '
-            'AND pgp_sym_decrypt(email_address, $4) = $2 AND webmail_service = $3',
-            self.discord_id, self.email_address, self.webmail_service,
-            os.getenv('database_encryption_key')
+        data = await get_subscriber_filters_by_hash(
+            self.discord_id, hash_email_address(self.email_address),
+            self.webmail_service, conn=conn
         )
 
         if data is not None:
-            self._sender_whitelist_enabled = data['sender_whitelist_enabled']
-            self._whitelisted_senders = data['whitelisted_senders'] or []
-            self._blacklisted_senders = data['blacklisted_senders'] or []
+            self._sender_whitelist_enabled = data.sender_whitelist_enabled
+            self._whitelisted_senders = list(data.whitelisted_senders)
+            self._blacklisted_senders = list(data.blacklisted_senders)
 
             return
 
@@ -97,10 +111,11 @@ class EmailNotificationFilters:
         # set sender whitelist enabled value in database
         await conn.execute(
             'UPDATE email_notification_filters SET sender_whitelist_enabled = $1 '
-            'WHERE discord_id = $2 AND pgp_sym_decrypt(email_address, $5) = $3 '
+            'WHERE discord_id = $2 AND email_address_hash = $3 '
             'AND webmail_service = $4', enabled, self.discord_id,
-            self.email_address, self.webmail_service, os.getenv('database_encryption_key')
+            hash_email_address(self.email_address), self.webmail_service
         )
+        await self._invalidate_cache(conn)
 
 
     async def __add_sender(
@@ -121,10 +136,12 @@ class EmailNotificationFilters:
         await conn.execute(
             'UPDATE email_notification_filters '
             f'SET {target_full} = {target_full} || pgp_sym_encrypt($1, $5) '
-            'WHERE discord_id = $2 AND pgp_sym_decrypt(email_address, $5) = $3 '
+            'WHERE discord_id = $2 AND email_address_hash = $3 '
             'AND webmail_service = $4', sender_email_address, self.discord_id,
-            self.email_address, self.webmail_service, os.getenv('database_encryption_key')
+            hash_email_address(self.email_address), self.webmail_service,
+            os.getenv('database_encryption_key')
         )
+        await self._invalidate_cache(conn)
 
         return True
 
@@ -138,10 +155,12 @@ class EmailNotificationFilters:
         await conn.execute(
             f'UPDATE email_notification_filters SET {target}ed_senders = '
             f'remove_encrypted_array_element($1, {target}ed_senders, $5) '
-            'WHERE discord_id = $2 AND pgp_sym_decrypt(email_address, $5) = $3 '
+            'WHERE discord_id = $2 AND email_address_hash = $3 '
             'AND webmail_service = $4', sender_email_address.lower(), self.discord_id,
-            self.email_address, self.webmail_service, os.getenv('database_encryption_key')
+            hash_email_address(self.email_address), self.webmail_service,
+            os.getenv('database_encryption_key')
         )
+        await self._invalidate_cache(conn)
 
 
 
@@ -207,3 +226,180 @@ class EmailNotificationFilters:
             one will be acquired automatically (must be passed as a keyword argument)
         """
         await self.__remove_sender(sender_email_address, conn, 'blacklist')
+
+
+def parse_sender_email_address(sender: str) -> str:
+    """
+    Extracts the lowercase email address portion of an email sender
+    for example, extracts `sender@example.com` from `Sender <Sender@example.com>`
+    :param sender: the value of the `From` header of an email
+    """
+    match = re.search(r'<(.*)>', sender)
+    return (match.group(1) if match else sender).lower()
+
+
+class SubscriberFilters(NamedTuple):
+    """The filter settings of a user that gets notified about an email address"""
+    discord_id: int
+    sender_whitelist_enabled: bool
+    whitelisted_senders: tuple[str, ...]
+    blacklisted_senders: tuple[str, ...]
+
+    def allows_sender(self, sender: str) -> bool:
+        """
+        Whether the user wants to be notified about emails from a sender
+        :param sender: the value of the `From` header of the email
+        """
+        sender = parse_sender_email_address(sender)
+
+        if self.sender_whitelist_enabled and sender not in self.whitelisted_senders:
+            return False
+
+        return sender not in self.blacklisted_senders
+
+
+class SubscriberFiltersChange(NamedTuple):
+    """
+    A change to the users subscribed to an email address, as sent on\
+        `SUBSCRIBER_FILTERS_CHANNEL`
+    """
+    op: Literal['INSERT', 'UPDATE', 'DELETE']
+    discord_id: int
+    email_address_hash: bytes
+    webmail_service: WebmailServiceLiteral
+
+    @classmethod
+    def from_payload(cls, payload: str) -> 'SubscriberFiltersChange':
+        data = json.loads(payload)
+        return cls(
+            data['op'],
+            data['discord_id'],
+            bytes.fromhex(data['email_address_hash']),
+            data['webmail_service']
+        )
+
+
+_SUBSCRIBER_FILTERS_COLUMNS = (
+    'discord_id, email_address_hash, webmail_service, sender_whitelist_enabled, '
+    'decrypt_array(whitelisted_senders, $1) AS whitelisted_senders, '
+    'decrypt_array(blacklisted_senders, $1) AS blacklisted_senders'
+)
+
+
+def _subscriber_filters_from_row(row) -> SubscriberFilters:
+    return SubscriberFilters(
+        row['discord_id'],
+        bool(row['sender_whitelist_enabled']),
+        tuple(row['whitelisted_senders'] or ()),
+        tuple(row['blacklisted_senders'] or ())
+    )
+
+
+@ensure_connection
+async def get_subscriber_filters(
+    email_address: str,
+    webmail_service: WebmailServiceLiteral,
+    conn: Connection=None
+) -> list[SubscriberFilters]:
+    """
+    Returns the filter settings of every user that has an email address\
+        connected, in a single query
+    :param email_address: the email address to get the subscribers of
+    :param webmail_service: the webmail service of the email address
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    rows = await conn.fetch(
+        f'SELECT {_SUBSCRIBER_FILTERS_COLUMNS} FROM email_notification_filters '
+        'WHERE email_address_hash = $2 AND webmail_service = $3',
+        os.getenv('database_encryption_key'),
+        hash_email_address(email_address), webmail_service
+    )
+    return [_subscriber_filters_from_row(row) for row in rows]
+
+
+@cached(
+    subscriber_filters_cache,
+    key=lambda discord_id, email_address_hash, webmail_service: (
+        discord_id, email_address_hash, webmail_service)
+)
+@ensure_connection
+async def get_subscriber_filters_by_hash(
+    discord_id: int,
+    email_address_hash: bytes,
+    webmail_service: WebmailServiceLiteral,
+    conn: Connection=None
+) -> SubscriberFilters | None:
+    """
+    Returns the filter settings of a single user for an email address, filter\
+        settings are cached (see `subscriber_filters_cache`)
+    :param discord_id: the discord id of the user
+    :param email_address_hash: the keyed hash of the email address\
+        (see `hash_email_address`)
+    :param webmail_service: the webmail service of the email address
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+
+    :return: the filter settings, or `None` if the user doesn't have the email\
+        address connected
+    """
+    row = await conn.fetchrow(
+        f'SELECT {_SUBSCRIBER_FILTERS_COLUMNS} FROM email_notification_filters '
+        'WHERE discord_id = $2 AND email_address_hash = $3 AND webmail_service = $4',
+        os.getenv('database_encryption_key'),
+        discord_id, email_address_hash, webmail_service
+    )
+    if row is None:
+        return None
+    return _subscriber_filters_from_row(row)
+
+
+@ensure_connection
+async def load_all_subscriber_filters(
+    conn: Connection=None
+) -> AsyncIterator[tuple[bytes, WebmailServiceLiteral, SubscriberFilters]]:
+    """
+    Yields the email address hash, webmail service and filter settings of\
+        every connected email address. Rows are read in chunks from a server\
+        side cursor, so memory use doesn't grow with the amount of rows.
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    # server side cursors only exist within a transaction
+    async with conn.transaction():
+        cursor = await conn.cursor(
+            f'SELECT {_SUBSCRIBER_FILTERS_COLUMNS} FROM email_notification_filters '
+            'WHERE email_address_hash IS NOT NULL',
+            os.getenv('database_encryption_key')
+        )
+
+        while rows := await cursor.fetch(config('global.subscriber_filters_chunk_size')):
+            for row in rows:
+                yield (
+                    row['email_address_hash'],
+                    row['webmail_service'],
+                    _subscriber_filters_from_row(row)
+                )
+
+
+@ensure_connection
+async def filter_subscribers(
+    email_address: str,
+    webmail_service: WebmailServiceLiteral,
+    sender: str,
+    conn: Connection=None
+) -> list[int]:
+    """
+    Returns the discord ids of the users that have an email address connected\
+        and whose filters allow emails from a sender
+    :param email_address: the email address that received the email
+    :param webmail_service: the webmail service of the email address
+    :param sender: the value of the `From` header of the email
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    subscribers = await get_subscriber_filters(email_address, webmail_service, conn=conn)
+    return [
+        subscriber.discord_id for subscriber in subscribers
+        if subscriber.allows_sender(sender)
+    ]
@@ -0,0 +1,56 @@
+"""Length-prefixed json message framing for the sockets between the apps"""
+
+import asyncio
+import json
+import struct
+
+from .exceptions import InvalidFrameError
+
+
+# every frame starts with the length of its payload as a 4 byte unsigned int
+FRAME_HEADER = struct.Struct('!I')
+
+MAX_FRAME_SIZE = 1024 * 1024  # bytes
+
+
+def encode_frame(message: dict) -> bytes:
+    """
+    Encodes a message into a frame that can be written to a socket
+    :param message: the json serializable message to encode
+    """
+    payload = json.dumps(message).encode()
+
+    if len(payload) > MAX_FRAME_SIZE:
+        raise InvalidFrameError(f'Frame of {len(payload)} bytes is too large')
+
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    """
+    Reads the next frame from a stream and decodes its message
+    :param reader: the stream to read from
+
+    :return: the message, or `None` if the stream was closed between frames
+    :raises InvalidFrameError: if the frame is oversized, cut off or not valid json
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial:
+            return None
+        raise InvalidFrameError('Stream closed in the middle of a frame header') from exc
+
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise InvalidFrameError(f'Frame of {size} bytes is too large')
+
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as exc:
+        raise InvalidFrameError('Stream closed in the middle of a frame') from exc
+
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError as exc:
+        raise InvalidFrameError('Frame payload is not valid json') from exc
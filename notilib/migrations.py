@@ -0,0 +1,67 @@
+"""Brings the schema and data of an existing database up to date"""
+
+import asyncio
+import os
+
+from asyncpg import Connection
+
+from .database import Database, ensure_connection, hashing_key
+
+
+@ensure_connection
+async def backfill_email_address_hashes(conn: Connection=None) -> None:
+    """
+    Sets the `email_address_hash` column of any rows that were created before
+    the column existed
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    # `hmac()` hashes the utf-8 bytes of the key and value, which
+    # matches what `hash_email_address` does on the python side
+    for table in ('gmail_credentials', 'email_notification_filters'):
+        await conn.execute(
+            f'UPDATE {table} SET email_address_hash = '
+            "hmac(pgp_sym_decrypt(email_address, $1), $2, 'sha256') "
+            'WHERE email_address_hash IS NULL',
+            os.getenv('database_encryption_key'), hashing_key()
+        )
+
+
+@ensure_connection
+async def migrate_previous_email_ids(conn: Connection=None) -> None:
+    """
+    Moves the ids in the old `gmail_credentials.previous_email_ids` array column
+    into the `gmail_seen_email_ids` table and drops the column
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    column_exists = await conn.fetchval(
+        'SELECT EXISTS (SELECT 1 FROM information_schema.columns '
+        "WHERE table_name = 'gmail_credentials' AND column_name = 'previous_email_ids')"
+    )
+    if not column_exists:
+        return
+
+    await conn.execute(
+        'INSERT INTO gmail_seen_email_ids (email_address_hash, email_id) '
+        'SELECT email_address_hash, unnest(previous_email_ids) FROM gmail_credentials '
+        'WHERE email_address_hash IS NOT NULL ON CONFLICT DO NOTHING'
+    )
+    await conn.execute('ALTER TABLE gmail_credentials DROP COLUMN previous_email_ids')
+
+
+@ensure_connection
+async def run_migrations(conn: Connection=None) -> None:
+    """
+    Applies the latest schema and runs every data migration in a single transaction
+    :param conn: an open database connection to execute on, if left as `None`,\
+        one will be acquired automatically (must be passed as a keyword argument)
+    """
+    async with conn.transaction():
+        await Database.setup_schema(conn=conn)
+        await backfill_email_address_hashes(conn=conn)
+        await migrate_previous_email_ids(conn=conn)
+
+
+if __name__ == '__main__':
+    asyncio.run(run_migrations())
@@ -2,11 +2,13 @@
 
 from asyncpg import Connection
 
-from .accounts import create_account, get_account
+from .accounts import accounts_cache, create_account, get_account
+from .cache import invalidate_everywhere
 from .database import ensure_connection
 
 
-@ensure_connection
+# not decorated with `@ensure_connection` so that cached account data doesn't
+# need a connection
 async def get_permissions(discord_id: int, conn: Connection=None) -> list:
     """
     Returns list of permissions for a discord user
@@ -21,7 +23,6 @@ async def get_permissions(discord_id: int, conn: Connection=None) -> list:
     return []
 
 
-@ensure_connection
 async def has_permission(
     discord_id: int,
     permissions: str | list[str],
@@ -84,6 +85,7 @@ async def set_permissions(
             'UPDATE accounts SET permissions = $1 WHERE discord_id = $2',
             permissions, discord_id
         )
+        await invalidate_everywhere(accounts_cache, discord_id, conn=conn)
     else:
         # otherwise create a new account with the correct permissions
         await create_account(discord_id, permissions=permissions, conn=conn)
@@ -43,3 +43,45 @@ BEGIN
   RETURN result;
 END;
 $$ LANGUAGE plpgsql;
+
+
+-- notifies listeners (such as the bot's mailbox routing table) whenever the
+-- users subscribed to an email address or their filter settings change
+CREATE OR REPLACE FUNCTION notify_email_notification_filters_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- a row that moved to another email address is removed from the old one
+  IF TG_OP = 'DELETE' OR (
+    TG_OP = 'UPDATE' AND (
+      OLD.discord_id <> NEW.discord_id
+      OR OLD.email_address_hash IS DISTINCT FROM NEW.email_address_hash
+      OR OLD.webmail_service <> NEW.webmail_service
+    )
+  ) THEN
+    IF OLD.email_address_hash IS NOT NULL THEN
+      PERFORM pg_notify('email_notification_filters', json_build_object(
+        'op', 'DELETE',
+        'discord_id', OLD.discord_id,
+        'email_address_hash', encode(OLD.email_address_hash, 'hex'),
+        'webmail_service', OLD.webmail_service
+      )::TEXT);
+    END IF;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.email_address_hash IS NOT NULL THEN
+    PERFORM pg_notify('email_notification_filters', json_build_object(
+      'op', TG_OP,
+      'discord_id', NEW.discord_id,
+      'email_address_hash', encode(NEW.email_address_hash, 'hex'),
+      'webmail_service', NEW.webmail_service
+    )::TEXT);
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER email_notification_filters_notify
+AFTER INSERT OR UPDATE OR DELETE ON email_notification_filters
+FOR EACH ROW EXECUTE FUNCTION notify_email_notification_filters_change();
@@ -9,19 +9,69 @@ CREATE TABLE IF NOT EXISTS accounts (
 
 CREATE TABLE IF NOT EXISTS gmail_credentials (
   email_address BYTEA NOT NULL,  -- encrypted email address
+  email_address_hash BYTEA,  -- keyed hash of the email address (used for lookups)
   credentials BYTEA,  -- encrypted oauth2 user credentials
   valid BOOLEAN DEFAULT TRUE,
+  history_id BIGINT,  -- gmail history id that the inbox has been synced up to
+  watch_expiration TIMESTAMPTZ  -- when the inbox watch has to be renewed by
+);
+
+ALTER TABLE gmail_credentials ADD COLUMN IF NOT EXISTS email_address_hash BYTEA;
+ALTER TABLE gmail_credentials ADD COLUMN IF NOT EXISTS history_id BIGINT;
+ALTER TABLE gmail_credentials ADD COLUMN IF NOT EXISTS watch_expiration TIMESTAMPTZ;
+CREATE INDEX IF NOT EXISTS gmail_credentials_email_address_hash_idx
+  ON gmail_credentials (email_address_hash);
+CREATE INDEX IF NOT EXISTS gmail_credentials_watch_expiration_idx
+  ON gmail_credentials (watch_expiration NULLS FIRST) WHERE valid = true;
 
-  -- in order to not resend notification (https://issuetracker.google.com/issues/36759803)
-  previous_email_ids TEXT[]
+-- in order to not resend notification (https://issuetracker.google.com/issues/36759803)
+CREATE TABLE IF NOT EXISTS gmail_seen_email_ids (
+  email_address_hash BYTEA NOT NULL,  -- keyed hash of the inbox email address
+  email_id TEXT NOT NULL,
+  seen_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+  seen_order BIGSERIAL,  -- insertion order, ids inserted together share the same `seen_at`
+  PRIMARY KEY(email_address_hash, email_id)
 );
 
+CREATE INDEX IF NOT EXISTS gmail_seen_email_ids_seen_at_idx
+  ON gmail_seen_email_ids (seen_at);
+
 CREATE TABLE IF NOT EXISTS email_notification_filters (
   discord_id BIGINT NOT NULL,
   email_address BYTEA NOT NULL,
+  email_address_hash BYTEA,  -- keyed hash of the email address (used for lookups)
   webmail_service TEXT NOT NULL,
   sender_whitelist_enabled BOOL DEFAULT FALSE,
   whitelisted_senders BYTEA[],
   blacklisted_senders BYTEA[],
   PRIMARY KEY(discord_id, email_address)
 );
+
+ALTER TABLE email_notification_filters ADD COLUMN IF NOT EXISTS email_address_hash BYTEA;
+CREATE INDEX IF NOT EXISTS email_notification_filters_email_address_hash_idx
+  ON email_notification_filters (email_address_hash, webmail_service);
+
+-- events waiting to be handled by the bot (for example gmail pushes)
+CREATE TABLE IF NOT EXISTS event_queue (
+  event_id BIGSERIAL PRIMARY KEY,
+  event_name TEXT NOT NULL,
+  payload BYTEA NOT NULL,  -- encrypted json keyword arguments of the event
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 5,
+  visible_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- when it can be claimed
+  created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS event_queue_visible_at_idx ON event_queue (visible_at);
+
+-- events that failed too many times
+CREATE TABLE IF NOT EXISTS event_queue_dead_letters (
+  event_id BIGINT PRIMARY KEY,
+  event_name TEXT NOT NULL,
+  payload BYTEA NOT NULL,
+  attempts INTEGER NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL,
+  failed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  last_error TEXT
+);
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+from .utils import MockData
+from notilib import AsyncCache, cache_key_token, cached
+from notilib import cache as cache_module
+
+
+@pytest.mark.asyncio
+async def test_cached_loads_once():
+    cache = AsyncCache('test_cached_loads_once', ttl=60, max_size=10)
+    calls = 0
+
+    @cached(cache, key=lambda value: value, copy=list)
+    async def load(value: int, conn=None) -> list[int]:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [value]
+
+    results = await asyncio.gather(*(load(1) for _ in range(5)))
+
+    assert results == [[1]] * 5
+    assert calls == 1
+
+    # modifying a returned value doesn't modify the cached one
+    results[0].append(2)
+    assert await load(1) == [1]
+    assert cache.stats()['hits'] == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidation():
+    cache = AsyncCache('test_cache_invalidation', ttl=60, max_size=1)
+    cache.set('key', 1)
+
+    cache.invalidate('key')
+    assert cache.get('key') is None
+
+    async def load() -> int:
+        # the cache is invalidated while loading
+        cache.invalidate('key')
+        return 2
+
+    assert await cache.get_or_load('key', load) == 2
+    assert cache.get('key') is None
+
+    # least recently used keys are evicted
+    cache.set('key', 1)
+    cache.set('other_key', 2)
+    assert cache.get('key') is None
+    assert cache.evictions == 1
+
+
+def test_cache_invalidation_by_token():
+    cache = AsyncCache('test_cache_invalidation_by_token', ttl=60, max_size=10)
+    key = (MockData.discord_id, MockData.email_address(), MockData.webmail_service)
+
+    cache.set(key, 1)
+
+    # tokens don't contain the key itself
+    assert MockData.email_address() not in cache_key_token(key)
+
+    cache.invalidate_tokens([cache_key_token(key)])
+    assert cache.get(key) is None
+
+
+def test_cache_invalidation_notification():
+    cache = AsyncCache('test_cache_invalidation_notification', ttl=60, max_size=10)
+    key = (MockData.discord_id, MockData.webmail_service)
+
+    cache.set(key, 1)
+
+    # notifications sent by this process are applied as well, since the old
+    # value may have been cached again before the invalidating write committed
+    payload = json.dumps({'cache': cache.name, 'tokens': [cache_key_token(key)]})
+    cache_module._on_cache_invalidation(None, 0, cache_module.CACHE_INVALIDATION_CHANNEL, payload)
+
+    assert cache.get(key) is None
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from notilib import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def refresh(value: int) -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        *(single_flight.run('key', refresh, i) for i in range(5)))
+
+    assert results == [0] * 5
+    assert calls == 1
+    assert 'key' not in single_flight
+
+    # a call after the previous one finished runs again
+    assert await single_flight.run('key', refresh, 1) == 1
+    assert calls == 2
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from .utils import MockData, RollbackTransaction, add_mock_email_address, db
+from notilib import email_addresses, scoped_connection
+
+
+@pytest.mark.asyncio
+async def test_scope_reuses_connection():
+    try:
+        async with db.scope(transaction=True) as conn:
+            assert scoped_connection() is conn
+
+            # uses the scoped connection, so the uncommitted email address is visible
+            await add_mock_email_address(MockData.email_address())
+            assert MockData.email_address() in await email_addresses.get_email_addresses(
+                discord_id=MockData.discord_id,
+                webmail_service=MockData.webmail_service
+            )
+
+            # other tasks don't share the connection
+            async def get_scoped_connection():
+                return scoped_connection()
+
+            assert await asyncio.create_task(get_scoped_connection()) is None
+
+            raise RollbackTransaction
+    except RollbackTransaction:
+        pass
+
+    assert scoped_connection() is None
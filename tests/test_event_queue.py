@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+import pytest
+
+from .utils import MockData
+from notilib import complete_events, dequeue_events, enqueue_event, fail_event
+
+
+@pytest.mark.asyncio
+async def test_enqueue_dequeue_complete(conn):
+    kwargs = {'email_address': MockData.email_address(), 'history_id': 1}
+    event_id = await enqueue_event('gmail_email_receive', kwargs, conn=conn)
+
+    events = await dequeue_events(1000, timedelta(minutes=5), conn=conn)
+    event = next(event for event in events if event.event_id == event_id)
+
+    assert event.event_name == 'gmail_email_receive'
+    assert event.kwargs == kwargs
+    assert event.attempts == 1
+
+    # claimed events are hidden until the visibility timeout passes
+    events = await dequeue_events(1000, timedelta(minutes=5), conn=conn)
+    assert event_id not in [event.event_id for event in events]
+
+    await complete_events([event_id], conn=conn)
+    assert not await conn.fetchval(
+        'SELECT EXISTS (SELECT 1 FROM event_queue WHERE event_id = $1)', event_id)
+
+
+@pytest.mark.asyncio
+async def test_fail_event_dead_letters(conn):
+    event_id = await enqueue_event('gmail_email_receive', {}, max_attempts=1, conn=conn)
+
+    events = await dequeue_events(1000, timedelta(minutes=5), conn=conn)
+    event = next(event for event in events if event.event_id == event_id)
+
+    assert await fail_event(event, 'error', timedelta(seconds=0), conn=conn) is False
+    assert await conn.fetchval(
+        'SELECT last_error FROM event_queue_dead_letters WHERE event_id = $1',
+        event_id) == 'error'
+
+
+@pytest.mark.asyncio
+async def test_dequeue_event_ids(conn):
+    event_id = await enqueue_event('gmail_email_receive', {}, conn=conn)
+    other_event_id = await enqueue_event('gmail_email_receive', {}, conn=conn)
+
+    events = await dequeue_events(10, timedelta(minutes=5), event_ids=[event_id], conn=conn)
+    assert [event.event_id for event in events] == [event_id]
+
+    # already claimed events are skipped
+    assert not await dequeue_events(
+        10, timedelta(minutes=5), event_ids=[event_id], conn=conn)
+
+    await complete_events([event_id, other_event_id], conn=conn)
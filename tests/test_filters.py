@@ -1,7 +1,12 @@
 import pytest
 
 from .utils import MockData, add_mock_email_address
-from notilib import EmailNotificationFilters
+from notilib import (
+    EmailNotificationFilters,
+    filter_subscribers,
+    get_subscriber_filters_by_hash,
+    hash_email_address
+)
 
 
 @pytest.fixture
@@ -65,3 +70,36 @@ async def test_set_sender_whitelist_enabled(conn, filters: EmailNotificationFilt
 
     await filters.set_sender_whitelist_enabled(enabled=True, conn=conn)
     assert await filters.sender_whitelist_enabled == True
+
+
+@pytest.mark.asyncio
+async def test_filter_subscribers(conn):
+    email_address = MockData.email_address.random()
+    sender = f'Sender <{MockData.email_address[1]}>'
+
+    await add_mock_email_address(email_address, discord_id=MockData.discord_id, conn=conn)
+    await add_mock_email_address(email_address, discord_id=MockData.discord_id_2, conn=conn)
+
+    blacklisting_filters = EmailNotificationFilters(
+        MockData.discord_id_2, email_address, MockData.webmail_service)
+    await blacklisting_filters.add_blacklisted_sender(MockData.email_address[1], conn=conn)
+
+    assert await filter_subscribers(
+        email_address, MockData.webmail_service, sender, conn=conn
+    ) == [MockData.discord_id]
+
+
+@pytest.mark.asyncio
+async def test_get_subscriber_filters_by_hash(conn):
+    email_address = MockData.email_address.random()
+    email_address_hash = hash_email_address(email_address)
+
+    assert await get_subscriber_filters_by_hash(
+        MockData.discord_id, email_address_hash, MockData.webmail_service, conn=conn
+    ) is None
+
+    await add_mock_email_address(email_address, conn=conn)
+
+    subscriber = await get_subscriber_filters_by_hash(
+        MockData.discord_id, email_address_hash, MockData.webmail_service, conn=conn)
+    assert subscriber.discord_id == MockData.discord_id
@@ -0,0 +1,238 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import pytest
+from aiogoogle import Aiogoogle
+from aiogoogle.auth import UserCreds
+from aiohttp import ClientError, MultipartReader, StreamReader
+from multidict import CIMultiDict
+
+from notilib.email_clients.gmail import batch, emails
+
+
+class MockResponse:
+    """Just enough of `aiohttp.ClientResponse` to read a multipart body from"""
+    def __init__(self, body: bytes, boundary: str) -> None:
+        self.headers = CIMultiDict({'Content-Type': f'multipart/mixed; boundary={boundary}'})
+
+        self.content = StreamReader(Mock(_reading_paused=False), 2**16)
+        self.content.feed_data(body)
+        self.content.feed_eof()
+
+    async def release(self) -> None:
+        pass
+
+
+async def mock_batch_server(body: bytes, boundary: str) -> bytes:
+    """
+    Reads the calls of a batch request and answers each one like gmail does,\
+        echoing the call back as the json body of its response
+    """
+    reader = MultipartReader.from_response(MockResponse(body, boundary))
+    response_body = bytearray()
+
+    while (part := await reader.next()) is not None:
+        head, _, call_body = (await part.read()).partition(b'\r\n\r\n')
+        request_line, *header_lines = head.decode().split('\r\n')
+
+        data = json.dumps({
+            'request_line': request_line,
+            'headers': header_lines,
+            'body': call_body.decode()
+        }).encode()
+
+        response_body += (
+            f'--{boundary}\r\n'
+            'Content-Type: application/http\r\n'
+            f'Content-ID: <response-{part.headers["Content-ID"]}>\r\n'
+            '\r\n'
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: application/json; charset=UTF-8\r\n'
+            '\r\n'
+        ).encode() + data + b'\r\n'
+
+    response_body += f'--{boundary}--\r\n'.encode()
+    return bytes(response_body)
+
+
+@pytest.mark.asyncio
+async def test_batch_body_round_trip():
+    parts = [
+        batch.build_batch_request_part('GET', '/gmail/v1/users/me/messages/abc?format=raw', 'token'),
+        batch.build_batch_request_part(
+            'POST', '/gmail/v1/users/me/watch', 'other_token', {'topicName': 'topic'})
+    ]
+
+    body = batch.build_batch_request_body(parts, 'batch_test')
+    response_body = await mock_batch_server(body, 'batch_test')
+
+    responses = {
+        response.content_id: response
+        async for response in batch.parse_batch_response(MockResponse(response_body, 'batch_test'))
+    }
+
+    assert list(responses) == [part.content_id for part in parts]
+
+    get_call = responses[parts[0].content_id]
+    assert get_call.ok and get_call.status == 200
+    assert get_call.headers['Content-Type'] == 'application/json; charset=UTF-8'
+    assert get_call.json() == {
+        'request_line': 'GET /gmail/v1/users/me/messages/abc?format=raw',
+        'headers': ['Authorization: Bearer token'],
+        'body': ''
+    }
+
+    watch_call = responses[parts[1].content_id].json()
+    assert watch_call['request_line'] == 'POST /gmail/v1/users/me/watch'
+    assert watch_call['headers'] == [
+        'Authorization: Bearer other_token',
+        'Content-Type: application/json',
+        f'Content-Length: {len(parts[1].body)}'
+    ]
+    assert json.loads(watch_call['body']) == {'topicName': 'topic'}
+
+
+@pytest.mark.asyncio
+async def test_parse_batch_response_statuses():
+    response_body = (
+        '--batch_test\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-abc>\r\n'
+        '\r\n'
+        'HTTP/1.1 404 Not Found\r\n'
+        '\r\n'
+        '\r\n'
+        '--batch_test\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-def>\r\n'
+        '\r\n'
+        'HTTP/1.1 429 Too Many Requests\r\n'
+        'Retry-After: 5\r\n'
+        '\r\n'
+        '{}\r\n'
+        '--batch_test--\r\n'
+    ).encode()
+
+    not_found, rate_limited = [
+        response async for response in
+        batch.parse_batch_response(MockResponse(response_body, 'batch_test'))
+    ]
+
+    assert not_found.content_id == 'abc'
+    assert not_found.status == 404 and not not_found.ok and not not_found.transient
+    assert not_found.json() == {}
+
+    assert rate_limited.content_id == 'def'
+    assert rate_limited.transient
+    assert rate_limited.headers['Retry-After'] == '5'
+
+
+def test_batch_request_parts_are_unique():
+    parts = [
+        batch.build_batch_request_part('GET', '/gmail/v1/users/me/profile', 'token')
+        for _ in range(10)
+    ]
+
+    assert len({part.content_id for part in parts}) == len(parts)
+
+
+@pytest.fixture
+def sent_batches(monkeypatch) -> list[list[str]]:
+    """Stubs out sending batch requests, recording the content ids of each batch"""
+    sent_batches = []
+
+    async def send_batch_request(parts, boundary='batch_gmail'):
+        sent_batches.append([part.content_id for part in parts])
+
+        # the last call of a batch doesn't get a response
+        return {
+            part.content_id: batch.BatchResponsePart(part.content_id, 200, {}, b'{}')
+            for part in parts[:-1]
+        }
+
+    monkeypatch.setattr(batch, 'send_batch_request', send_batch_request)
+    return sent_batches
+
+
+def mock_part() -> batch.BatchRequestPart:
+    return batch.build_batch_request_part('GET', '/gmail/v1/users/me/profile', 'token')
+
+
+@pytest.mark.asyncio
+async def test_collector_flushes_full_batches(sent_batches):
+    collector = batch.BatchCollector(delay=60, max_calls=3)
+    parts = [mock_part() for _ in range(4)]
+
+    # full batches are sent right away rather than after the delay
+    responses = await asyncio.wait_for(
+        asyncio.gather(*(collector.submit(part) for part in parts[:3])), timeout=1)
+
+    assert sent_batches == [[part.content_id for part in parts[:3]]]
+    assert [response.status for response in responses] == [200, 200, 0]
+
+    # the next call waits for the delay
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(collector.submit(parts[3]), timeout=0.05)
+
+    assert len(sent_batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_collector_waits_for_more_calls(sent_batches):
+    collector = batch.BatchCollector(delay=0.05)
+    parts = [mock_part() for _ in range(3)]
+
+    async def submit_later(part: batch.BatchRequestPart) -> batch.BatchResponsePart:
+        await asyncio.sleep(0.01)
+        return await collector.submit(part)
+
+    # calls submitted within the delay are sent together
+    await asyncio.gather(collector.submit(parts[0]), submit_later(parts[1]))
+    await collector.submit(parts[2])
+
+    assert sent_batches == [
+        [parts[0].content_id, parts[1].content_id],
+        [parts[2].content_id]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_collector_propagates_failures(monkeypatch):
+    async def send_batch_request(parts, boundary='batch_gmail'):
+        raise ClientError('batch request failed')
+
+    monkeypatch.setattr(batch, 'send_batch_request', send_batch_request)
+    collector = batch.BatchCollector(delay=0.01)
+
+    results = await asyncio.gather(
+        collector.submit(mock_part()), collector.submit(mock_part()), return_exceptions=True)
+
+    assert all(isinstance(result, ClientError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_fetched_individually(monkeypatch):
+    async def send_batch_request(parts, boundary='batch_gmail'):
+        raise asyncio.TimeoutError
+
+    fetched_email_ids = []
+
+    async def fetch_email(google, gmail, email_id, profile):
+        fetched_email_ids.append(email_id)
+        return {'id': email_id}
+
+    monkeypatch.setattr(batch, 'send_batch_request', send_batch_request)
+    monkeypatch.setattr(emails, '_email_batch_collector', batch.BatchCollector(delay=0.01))
+    monkeypatch.setattr(emails, '__fetch_email', fetch_email)
+
+    google = Aiogoogle(user_creds=UserCreds(access_token='token'))
+    fetch_email_batched = getattr(emails, '__fetch_email_batched')
+
+    results = await asyncio.gather(*(
+        fetch_email_batched(google, None, email_id, emails.METADATA_EMAIL_PROFILE)
+        for email_id in ('abc', 'def')
+    ))
+
+    assert results == [{'id': 'abc'}, {'id': 'def'}]
+    assert fetched_email_ids == ['abc', 'def']
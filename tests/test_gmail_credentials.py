@@ -0,0 +1,34 @@
+import pytest
+from aiogoogle.auth import UserCreds
+
+from .utils import MockData
+from notilib.email_clients import gmail
+
+
+@pytest.mark.asyncio
+async def test_load_all_user_credentials(conn):
+    email_address = MockData.email_address()
+    await gmail.save_user_credentials(
+        email_address, UserCreds(access_token='abc'), conn=conn)
+
+    all_creds = {
+        creds.email_address: creds.user_creds
+        async for creds in gmail.load_all_user_credentials(refresh=False, conn=conn)
+    }
+
+    assert all_creds[email_address]['access_token'] == 'abc'
+
+
+@pytest.mark.asyncio
+async def test_load_all_user_credentials_skips_invalid(conn):
+    email_address = MockData.email_address()
+    await gmail.save_user_credentials(
+        email_address, UserCreds(access_token='abc'), conn=conn)
+    await gmail.set_credentials_validity(email_address, valid=False, conn=conn)
+
+    email_addresses = [
+        creds.email_address
+        async for creds in gmail.load_all_user_credentials(refresh=False, conn=conn)
+    ]
+
+    assert email_address not in email_addresses
@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+import pytest
+from aiogoogle.auth import UserCreds
+
+from .utils import MockData, db
+from notilib import hash_email_address
+from notilib.email_clients import gmail
+from notilib.email_clients.gmail import emails
+
+
+@pytest.mark.asyncio
+async def test_add_previous_email_id(conn):
+    email_address = MockData.email_address()
+
+    assert await gmail.add_previous_email_id(email_address, 'abc', conn=conn) is True
+    assert await gmail.add_previous_email_id(email_address, 'abc', conn=conn) is False
+
+    assert 'abc' in await gmail.get_previous_email_ids(email_address, conn=conn)
+
+
+@pytest.mark.asyncio
+async def test_set_previous_email_ids(conn):
+    email_address = MockData.email_address()
+
+    await gmail.set_previous_email_ids(email_address, ['abc'], conn=conn)
+    await gmail.set_previous_email_ids(email_address, ['def', 'ghi'], conn=conn)
+
+    previous_email_ids = await gmail.get_previous_email_ids(email_address, conn=conn)
+    assert previous_email_ids == ['def', 'ghi']
+
+
+@pytest.mark.asyncio
+async def test_prune_previous_email_ids_cap(conn):
+    email_address = MockData.email_address()
+
+    for email_id in ('abc', 'def', 'ghi'):
+        await gmail.add_previous_email_id(email_address, email_id, conn=conn)
+
+    await gmail.prune_previous_email_ids(
+        retention=timedelta(days=1), max_per_email_address=2, conn=conn)
+
+    # the ids are seen at the same time (in the same transaction), the newest are kept
+    assert await gmail.get_previous_email_ids(email_address, conn=conn) == ['ghi', 'def']
+
+
+@pytest.mark.asyncio
+async def test_set_history_id_never_decreases(conn):
+    email_address = MockData.email_address()
+    await gmail.save_user_credentials(
+        email_address, UserCreds(access_token='abc'), conn=conn)
+
+    await gmail.set_history_id(email_address, 10, conn=conn)
+    await gmail.set_history_id(email_address, '5', conn=conn)
+
+    assert await gmail.get_history_id(email_address, conn=conn) == 10
+
+
+@pytest.mark.asyncio
+async def test_concurrent_syncs_dont_exhaust_the_pool(monkeypatch):
+    pool = await db.connect()
+
+    # more inboxes than there are connections, none of them have a history id
+    # yet, so they all sync the legacy way
+    email_addresses = [
+        f'sync_{i}_{MockData.email_address()}' for i in range(pool.get_max_size() + 5)]
+
+    async def load_user_credentials(email_address: str, conn=None) -> UserCreds:
+        return UserCreds(access_token='abc')
+
+    @asynccontextmanager
+    async def google_client(user_creds: UserCreds):
+        yield None
+
+    async def get_gmail_api():
+        return None
+
+    async def retrieve_email_ids(count, google, gmail=None) -> list[str]:
+        await asyncio.sleep(0.1)  # waiting on gmail
+        return ['abc']
+
+    async def retrieve_emails(google, email_ids=None, profile=None, **_) -> list[gmail.Email]:
+        await asyncio.sleep(0.1)  # waiting on gmail
+        return [gmail.Email({'id': email_id, 'labelIds': ['INBOX']}) for email_id in email_ids]
+
+    monkeypatch.setattr(emails, 'load_user_credentials', load_user_credentials)
+    monkeypatch.setattr(emails, 'google_client', google_client)
+    monkeypatch.setattr(emails, 'get_gmail_api', get_gmail_api)
+    monkeypatch.setattr(emails, '__retrieve_email_ids', retrieve_email_ids)
+    monkeypatch.setattr(emails, '__retrieve_emails', retrieve_emails)
+
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(
+                gmail.sync_new_emails(email_address, 1)
+                for email_address in email_addresses
+            )),
+            timeout=10
+        )
+
+        assert [[email.id for email in synced] for synced in results] == \
+            [['abc']] * len(email_addresses)
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute(
+                'DELETE FROM gmail_seen_email_ids WHERE email_address_hash = ANY($1::BYTEA[])',
+                [hash_email_address(email_address) for email_address in email_addresses]
+            )
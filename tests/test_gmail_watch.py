@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiogoogle.auth import UserCreds
+
+from .utils import MockData
+from notilib.email_clients import gmail
+
+
+@pytest.mark.asyncio
+async def test_get_inboxes_due_for_rewatch(conn):
+    due_email_address = MockData.email_address[0]
+    watched_email_address = MockData.email_address[1]
+
+    for email_address in (due_email_address, watched_email_address):
+        await gmail.save_user_credentials(
+            email_address, UserCreds(access_token='abc'), conn=conn)
+
+    now = datetime.now(timezone.utc)
+    await gmail.set_watch_expiration(
+        due_email_address, now + timedelta(hours=1), conn=conn)
+    await gmail.set_watch_expiration(
+        watched_email_address, now + timedelta(days=7), conn=conn)
+
+    due = await gmail.get_inboxes_due_for_rewatch(
+        window=timedelta(days=1), limit=1000, conn=conn)
+    email_addresses = [creds.email_address for creds in due]
+
+    assert due_email_address in email_addresses
+    assert watched_email_address not in email_addresses
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from .utils import MockData
+from notilib import backfill_email_address_hashes, email_addresses
+
+
+@pytest.mark.asyncio
+async def test_backfill_email_address_hashes(conn):
+    # insert a row the way it was stored before email addresses were hashed
+    await conn.execute(
+        'INSERT INTO email_notification_filters '
+        '(discord_id, email_address, webmail_service) '
+        'VALUES ($1, pgp_sym_encrypt($2, $4), $3)',
+        MockData.discord_id, MockData.email_address(), MockData.webmail_service,
+        os.getenv('database_encryption_key')
+    )
+
+    await backfill_email_address_hashes(conn=conn)
+
+    # the row should now be found by the hashed lookup
+    discord_ids = await email_addresses.email_address_to_discord_ids(
+        email_address=MockData.email_address(),
+        webmail_service=MockData.webmail_service,
+        conn=conn
+    )
+    assert MockData.discord_id in discord_ids
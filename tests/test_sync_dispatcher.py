@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from .utils import MockData
+from apps.bot.helper.gmail.sync_dispatcher import MailboxSyncDispatcher, _merge_history_ids
+
+
+class MockSync:
+    """Records the syncs it is called for, each sync runs until it is released"""
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, int | None]] = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, email_address: str, history_id: int | None) -> None:
+        self.calls.append((email_address, history_id))
+        await self.release.wait()
+
+
+def test_merge_history_ids():
+    assert _merge_history_ids(1, 2) == 2
+    assert _merge_history_ids('3', 2) == 3
+
+    # a push without a history id wins the merge
+    assert _merge_history_ids(None, 2) is None
+    assert _merge_history_ids(2, None) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pushes_are_coalesced():
+    sync = MockSync()
+    dispatcher = MailboxSyncDispatcher(sync)
+    email_address = MockData.email_address()
+
+    first = asyncio.create_task(dispatcher.submit(email_address, 1))
+    await asyncio.sleep(0.01)
+
+    # pushes received while the first sync is running
+    follow_ups = [
+        asyncio.create_task(dispatcher.submit(email_address, history_id))
+        for history_id in (3, 2, 4)
+    ]
+    await asyncio.sleep(0.01)
+
+    assert sync.calls == [(email_address, 1)]
+
+    sync.release.set()
+    await asyncio.wait_for(asyncio.gather(first, *follow_ups), timeout=1)
+
+    # one follow-up sync with the highest history id
+    assert sync.calls == [(email_address, 1), (email_address, 4)]
+    assert dispatcher._states == {}
+
+
+@pytest.mark.asyncio
+async def test_push_without_history_id_wins_the_merge():
+    sync = MockSync()
+    dispatcher = MailboxSyncDispatcher(sync)
+    email_address = MockData.email_address()
+
+    first = asyncio.create_task(dispatcher.submit(email_address, 1))
+    await asyncio.sleep(0.01)
+
+    follow_ups = [
+        asyncio.create_task(dispatcher.submit(email_address, history_id))
+        for history_id in (2, None, 3)
+    ]
+    await asyncio.sleep(0.01)
+
+    sync.release.set()
+    await asyncio.wait_for(asyncio.gather(first, *follow_ups), timeout=1)
+
+    assert sync.calls == [(email_address, 1), (email_address, None)]
+
+
+@pytest.mark.asyncio
+async def test_mailboxes_sync_independently():
+    sync = MockSync()
+    dispatcher = MailboxSyncDispatcher(sync)
+    email_addresses = MockData.email_address.all[:2]
+
+    tasks = [
+        asyncio.create_task(dispatcher.submit(email_address, 1))
+        for email_address in email_addresses
+    ]
+    await asyncio.sleep(0.01)
+
+    assert sync.calls == [(email_address, 1) for email_address in email_addresses]
+
+    sync.release.set()
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_failed_sync_reaches_its_waiters():
+    calls = []
+
+    async def sync(email_address: str, history_id: int | None) -> None:
+        calls.append(history_id)
+        await asyncio.sleep(0.05)
+
+        if history_id == 1:
+            raise ConnectionError
+
+    dispatcher = MailboxSyncDispatcher(sync)
+    email_address = MockData.email_address()
+
+    first = asyncio.create_task(dispatcher.submit(email_address, 1))
+    await asyncio.sleep(0.01)
+    follow_up = asyncio.create_task(dispatcher.submit(email_address, 2))
+
+    with pytest.raises(ConnectionError):
+        await first
+
+    # the follow-up sync still runs after the failed one
+    await asyncio.wait_for(follow_up, timeout=1)
+    assert calls == [1, 2]
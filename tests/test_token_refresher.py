@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+from aiogoogle.auth.creds import UserCreds
+
+from .utils import MockData
+from apps.bot.helper.gmail import token_refresher
+from apps.bot.helper.gmail.token_refresher import TokenRefresher
+from notilib import InvalidRefreshTokenError
+
+
+def mock_user_creds(expires_in: timedelta) -> UserCreds:
+    expires_at = datetime.utcnow() + expires_in
+    return UserCreds(access_token='abc', expires_at=expires_at.isoformat())
+
+
+@pytest.fixture
+def refresher(monkeypatch) -> TokenRefresher:
+    # no jitter, and every refresh is due
+    monkeypatch.setattr(token_refresher.random, 'random', lambda: 0)
+    return TokenRefresher()
+
+
+def pop_all_due(refresher: TokenRefresher, monkeypatch) -> list[str]:
+    class FutureDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=1)
+
+    monkeypatch.setattr(token_refresher, 'datetime', FutureDatetime)
+    due = refresher._pop_due()
+    monkeypatch.setattr(token_refresher, 'datetime', datetime)
+
+    return [email_address for _, email_address in due]
+
+
+def test_refreshes_are_due_in_expiry_order(refresher, monkeypatch):
+    email_addresses = MockData.email_address.all[:3]
+
+    for email_address, expires_in in zip(email_addresses, (30, 10, 20)):
+        refresher._schedule_refresh(
+            email_address, mock_user_creds(timedelta(minutes=expires_in)))
+
+    # rescheduling leaves the previous entry in the heap, which is skipped
+    refresher._schedule_refresh(email_addresses[0], mock_user_creds(timedelta(minutes=5)))
+
+    assert pop_all_due(refresher, monkeypatch) == [
+        email_addresses[0], email_addresses[1], email_addresses[2]]
+    assert refresher._pop_due() == []
+
+
+def test_expired_credentials_are_due_now(refresher):
+    refresher._schedule_refresh(
+        MockData.email_address(), mock_user_creds(timedelta(minutes=-5)))
+
+    assert [email_address for _, email_address in refresher._pop_due()] == \
+        [MockData.email_address()]
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_is_retried(refresher, monkeypatch):
+    email_address = MockData.email_address()
+    refresher._schedule_refresh(email_address, mock_user_creds(timedelta(minutes=-5)))
+    (refresh_at, _), = refresher._pop_due()
+
+    async def fail(*_, **__):
+        raise ConnectionError
+
+    monkeypatch.setattr(token_refresher, 'refresh_user_credentials', fail)
+    await refresher._refresh(refresh_at, email_address)
+
+    assert refresher.metrics.failures == 1
+
+    # retried after the retry delay rather than right away
+    assert refresher._pop_due() == []
+    assert pop_all_due(refresher, monkeypatch) == [email_address]
+
+    async def refresh(*_, **__):
+        return mock_user_creds(timedelta(hours=1))
+
+    monkeypatch.setattr(token_refresher, 'refresh_user_credentials', refresh)
+    await refresher._refresh(refresh_at, email_address)
+
+    assert refresher.metrics.refreshes == 1
+    assert refresher._refresh_at[email_address] > datetime.utcnow()
+
+
+@pytest.mark.asyncio
+async def test_invalid_credentials_are_unscheduled(refresher, monkeypatch):
+    email_address = MockData.email_address()
+    refresher._schedule_refresh(email_address, mock_user_creds(timedelta(minutes=-5)))
+    (refresh_at, _), = refresher._pop_due()
+
+    async def invalidate(*_, **__):
+        raise InvalidRefreshTokenError
+
+    monkeypatch.setattr(token_refresher, 'refresh_user_credentials', invalidate)
+    await refresher._refresh(refresh_at, email_address)
+
+    assert refresher.metrics.invalidated == 1
+    assert email_address not in refresher._refresh_at